@@ -18,7 +18,9 @@ crossword is the grid completely filled out.
 A crossword consists of fields. A field has a single letter. This is usually a
 single character in the strict sense, but Dutch crosswords count "IJ" as a
 single letter, so I avoid the term character. Fields that have no corresponding
-letter are called black fields.
+letter are called black fields. Internally, letters are numbered by the
+Alphabet of the vocabulary index, and the length of a sequence is its number of
+letters.
 
 Fields in crosswords have coordinates (X,Y). X coordinates are counted left to
 right, starting at 0. Y coordinates are counted top to bottom, starting at 0.
@@ -32,8 +34,102 @@ be filled into a sequence.
 
 import random
 import copy
+import math
+import time
+from collections import deque
 import numpy as np
 
+from vocabindex import VocabIndex, ids, popcount, nthBit, tokenise
+
+#-------------------------------------------------------------------------------
+# slots in an empty grid
+#-------------------------------------------------------------------------------
+
+def slots(grid):
+    """Find the sequences in an empty grid, indexed [x,y]. Returns a list of
+    (cors, direction): first the horizontal sequences row by row, then the
+    vertical sequences column by column."""
+    width, height = grid.shape
+    found = []
+
+    #horizontal sequences
+    for y in range(height):
+        left = False
+        for x in range(width - 1):
+            current = grid[x,y]
+            right = grid[x+1, y]
+            if (left, current, right) == (False, True, True):
+                #if this is the start of a new sequence
+                #check length of sequence
+                l = 0
+                for value in grid[x:, y]:
+                    if value:
+                        l += 1
+                    else:
+                        break
+                found.append(([(xcor, y) for xcor in range(x, x+l)], 'hor'))
+            left = current
+
+    #vertical sequences
+    for x in range(width):
+        above = False
+        for y in range(height - 1):
+            current = grid[x,y]
+            below = grid[x, y+1]
+            if (above, current, below) == (False, True, True):
+                l = 0
+                for value in grid[x, y:]:
+                    if value:
+                        l += 1
+                    else:
+                        break
+                found.append(([(x, ycor) for ycor in range(y, y+l)], 'ver'))
+            above = current
+
+    return found
+
+def feasible(grid, index, rounds=1):
+    """Cheap check whether an empty grid, indexed [x,y], could be filled in with
+    the words of a VocabIndex, without building a Crossword.
+
+    Every sequence starts with all words of its length. In each round, the
+    letters of every field are limited to those that both crossing sequences
+    allow, and the wordsets are limited to words with those letters. Returns
+    False as soon as a wordset is empty. True does not mean that the grid can be
+    filled in, only that this check could not rule it out."""
+    found = slots(grid)
+    indices = [index.Length(len(cors)) for cors, direction in found]
+    masks = [lengthindex.full for lengthindex in indices]
+    if not all(masks):
+        return False
+
+    #the fields where a horizontal and a vertical sequence cross
+    hor = dict()
+    for k, (cors, direction) in enumerate(found):
+        if direction == 'hor':
+            for i, cor in enumerate(cors):
+                hor[cor] = (k, i)
+    crossings = []
+    for k, (cors, direction) in enumerate(found):
+        if direction == 'ver':
+            for j, cor in enumerate(cors):
+                if cor in hor:
+                    crossings.append(hor[cor] + (k, j))
+
+    for r in range(rounds):
+        new = list(masks)
+        for h, i, v, j in crossings:
+            letters = indices[h].Letters(masks[h], i) & indices[v].Letters(masks[v], j)
+            new[h] &= indices[h].LetterMask(i, letters)
+            new[v] &= indices[v].LetterMask(j, letters)
+        if not all(new):
+            return False
+        if new == masks:
+            break
+        masks = new
+
+    return True
+
 #-------------------------------------------------------------------------------
 # sequence class
 #-------------------------------------------------------------------------------
@@ -42,264 +138,473 @@ class Sequence:
     def __init__(self, cors, direction, crossword):
         self.l = len(cors)
         self.cors = cors
+        self.position = {cors[i]: i for i in range(len(cors))}
         self.direction = direction
         if self.direction == 'hor':
             self.otherdirection = 'ver'
         else:
             self.otherdirection = 'hor'
 
-        self.wordset = crossword.vocabdict[self.l]
+        #the wordset is stored as a bitset over the words of this length
+        self.index = crossword.index.Length(self.l)
+        self.mask = self.index.full
+        #bitset of the decision levels that caused the wordset to shrink
+        self.culprits = 0
         self.UpdateLetters()
         self.cw = crossword
 
     def __len__(self):
         return len(self.cors)
 
+    @property
+    def wordset(self):
+        """The set of words that can still be filled in."""
+        return set(self.index.Words(self.mask))
+
+    @wordset.setter
+    def wordset(self, words):
+        #go through SetMask, so the change is on the trail and the letters and heap are updated
+        self.SetMask(self.index.Mask(words))
+
+    def Count(self):
+        """Number of words left in the wordset."""
+        return popcount(self.mask)
+
+    def Word(self):
+        """Return the word filled in, or None if the sequence is not filled in."""
+        if self.Count() == 1:
+            return self.index.words[self.mask.bit_length() - 1]
+        return None
+
+    def Has(self, word):
+        """Check whether a word is still in the wordset."""
+        j = self.index.id.get(word)
+        return j is not None and (self.mask >> j) & 1 == 1
+
     def UpdateLetters(self):
         """Update letter lists based on wordset."""
-        newlist = []
-        for i in range(len(self)):
-            newset = set(w[i] for w in self.wordset)
-            newlist.append(newset)
-
-        self.letteroptions = newlist
+        self.letteroptions = [self.index.Letters(self.mask, i) for i in range(len(self))]
 
     def Letters(self, x, y):
         """Get the letter list of a field based on its coordinates."""
-        for i in range(len(self.cors)):
-            xcor, ycor = self.cors[i]
-            if (xcor, ycor) == (x,y):
-                return self.letteroptions[i]
+        i = self.position.get((x,y))
+        if i is not None:
+            return self.letteroptions[i]
         return None
 
-    def ExcludeLetter(self, i, letter):
-        """Exclude a letter from a position and update the wordset."""
-        newset = set()
-        for w in self.wordset:
-            if w[i] != letter:
-                newset.add(w)
-        self.wordset = newset
+    def SetMask(self, mask, culprits=0):
+        """Replace the wordset by a new bitset and update the letter lists. The
+        old state is saved on the crossword's trail, so it can be undone.
+        Culprits is the bitset of decision levels that caused the change."""
+        self.cw.Save(self)
+        self.mask = mask
+        self.culprits |= culprits
         self.UpdateLetters()
+        self.cw.Changed(self)
 
-    def Choose(self, word):
-        """Turn wordset into a single word. Return list of coordinates for which the letterset has changed."""
-        self.wordset = {word}
-
-        #get indices of changed fields
-        fieldindices = []
-        for i in range(len(self)):
-            if len(self.letteroptions[i]) > 1:
-                self.letteroptions[i] = set(word[i])
-                fieldindices.append(i)
-
-        #get sequences intersecting with changed fields
-        neighbours = []
-        for i in fieldindices:
-            otherseq = self.cw.Intersect(self, i)
-            if otherseq:
-                neighbours.append(otherseq)
-
-        return neighbours
+    def ExcludeLetter(self, i, letter):
+        """Exclude a letter (given as its number in the alphabet) from a
+        position and update the wordset."""
+        self.SetMask(self.mask & ~self.index.masks[i].get(letter, 0))
+
+    def Choose(self, word, culprits=0):
+        """Turn wordset into a single word. Return the arcs of the crossing
+        sequences that need to be revised, see Crossword.Revise."""
+        oldletteroptions = self.letteroptions
+        self.SetMask(self.index.Mask([word]), culprits)
+        return self.cw.Arcs(self, oldletteroptions)
+
+    def ExcludeWord(self, word, culprits=0):
+        """Remove word from wordset and update letter options. Return the arcs
+        of the crossing sequences that need to be revised."""
+        oldletteroptions = self.letteroptions
+        self.SetMask(self.mask & ~(1 << self.index.id[word]), culprits)
+        return self.cw.Arcs(self, oldletteroptions)
 
-    def ExcludeWord(self, word):
-        """Remove word from wordset and update letter options."""
-        self.wordset.remove(word)
-        oldletteroptions = copy.deepcopy(self.letteroptions)
-        self.UpdateLetters()
-        #this can be more efficient. You only need to see if one letter per position is still an option.
+    def Copy(self, crossword):
+        """Return a deep copy"""
+        newseq = Sequence(self.cors, self.direction, crossword)
+        newseq.mask = self.mask
+        newseq.culprits = self.culprits
+        newseq.UpdateLetters()
+        return newseq
 
-        #get list of sequences that may be affected
-        cors_to_update = list()
-        for i in range(len(self)):
-            if self.letteroptions[i] != oldletteroptions[i]:
-                cors_to_update.append(self.cors[i])
+#-------------------------------------------------------------------------------
+# heap class
+#-------------------------------------------------------------------------------
 
-        neighbours = list()
-        for x,y in cors_to_update:
-            neighbours.append(self.cw.Seq(x,y, self.otherdirection))
+class Heap:
+    """Binary min-heap of (key, id) items. The heap keeps track of the position
+    of every id, so the key of an id can be changed or the id can be removed in
+    O(log n)."""
 
-        return neighbours
+    def __init__(self):
+        self.items = []
+        self.pos = dict()
 
-    def Copy(self, crossword):
-        """Return a deep copy"""
-        newseq = Sequence(self.cors, self.direction, crossword)
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, k):
+        return k in self.pos
+
+    def Min(self):
+        """Return the id with the smallest key."""
+        return self.items[0][1]
+
+    def Set(self, k, key):
+        """Insert an id, or change its key if it is already in the heap."""
+        if k in self.pos:
+            i = self.pos[k]
+            oldkey = self.items[i][0]
+            self.items[i] = (key, k)
+            if key < oldkey:
+                self.SiftUp(i)
+            else:
+                self.SiftDown(i)
+        else:
+            self.items.append((key, k))
+            self.pos[k] = len(self.items) - 1
+            self.SiftUp(len(self.items) - 1)
+
+    def Remove(self, k):
+        """Remove an id from the heap, if it is in there."""
+        if k in self.pos:
+            i = self.pos.pop(k)
+            last = self.items.pop()
+            if i < len(self.items):
+                self.items[i] = last
+                self.pos[last[1]] = i
+                self.SiftUp(i)
+                self.SiftDown(self.pos[last[1]])
+
+    def SiftUp(self, i):
+        items, pos = self.items, self.pos
+        item = items[i]
+        while i > 0:
+            parent = (i - 1) // 2
+            if items[parent] <= item:
+                break
+            items[i] = items[parent]
+            pos[items[i][1]] = i
+            i = parent
+        items[i] = item
+        pos[item[1]] = i
+
+    def SiftDown(self, i):
+        items, pos = self.items, self.pos
+        n = len(items)
+        item = items[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and items[child + 1] < items[child]:
+                child += 1
+            if item <= items[child]:
+                break
+            items[i] = items[child]
+            pos[items[i][1]] = i
+            i = child
+        items[i] = item
+        pos[item[1]] = i
 
-        newseq.wordset = copy.deepcopy(set([w for w in self.wordset]))
+#-------------------------------------------------------------------------------
+# weighted sampler
+#-------------------------------------------------------------------------------
 
-        newseq.UpdateLetters()
-        return newseq
+class Fenwick:
+    """Fenwick tree over the scores of the words in a wordset, to sample a word
+    with probability proportional to its score in O(log n).
+
+    The tree is kept for a sequence during a search. Its wordset is brought up
+    to date with Sync, which only updates the words that changed since the last
+    Sync, or builds the tree again if many words changed.
+
+    Scores are scaled to integers, so that adding and removing words does not
+    build up rounding errors."""
+
+    def __init__(self, scores, mask):
+        self.n = len(scores)
+        top = max(float(np.max(scores, initial=0)), 1e-300)
+        self.weights = np.maximum(1, np.round(np.asarray(scores) / top * 2**30)).astype(np.int64)
+        self.Build(mask)
+
+    def Build(self, mask):
+        live = np.zeros(self.n, dtype=np.int64)
+        j = ids(mask, self.n)
+        live[j] = self.weights[j]
+        #node i holds the sum of the weights in (i - lowbit(i), i]
+        cumulative = np.concatenate([[0], np.cumsum(live)])
+        nodes = np.arange(1, self.n + 1)
+        self.tree = [0.0] + (cumulative[nodes] - cumulative[nodes - (nodes & -nodes)]).tolist()
+        self.mask = mask
+
+    def Add(self, j, weight):
+        i = j + 1
+        while i <= self.n:
+            self.tree[i] += weight
+            i += i & -i
+
+    def Sync(self, mask):
+        """Change the wordset of the tree to a new bitset."""
+        diff = self.mask ^ mask
+        if popcount(diff) * self.n.bit_length() > self.n:
+            self.Build(mask)
+            return
+        for j in ids(diff, self.n).tolist():
+            weight = int(self.weights[j])
+            self.Add(j, weight if (mask >> j) & 1 else -weight)
+        self.mask = mask
+
+    def Total(self):
+        total = 0
+        i = self.n
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def Sample(self, u):
+        """Return the id of a word, given a random number 0 <= u < 1."""
+        total = self.Total()
+        rest = min(int(u * total), total - 1)
+        j = 0
+        step = 1 << self.n.bit_length()
+        while step:
+            if j + step <= self.n and self.tree[j + step] <= rest:
+                j += step
+                rest -= self.tree[j]
+            step >>= 1
+        return j
 
 #-------------------------------------------------------------------------------
 # crossword class
 #-------------------------------------------------------------------------------
 
 class Crossword:
-    def __init__(self, grid, vocabdict=None):
-        """Initialise from empty grid or from other crossword"""
+    def __init__(self, grid, vocabdict=None, tiebreak=None):
+        """Initialise from empty grid or from other crossword. The tiebreak
+        decides between sequences with equally small wordsets in NextSeq: None
+        (the first sequence), 'degree' (the most crossings) or 'entropy' (the
+        fewest letter options)."""
         if type(grid) == Crossword:
             self.InitFromCrossword(grid)
 
         else:
+            self.tiebreak = tiebreak
             self.vocabdict = vocabdict
+            if type(vocabdict) == VocabIndex:
+                self.index = vocabdict
+            else:
+                self.index = VocabIndex(vocabdict)
             self.Empty = grid
+            #undo log of changes to the sequences, see Save and Undo
+            self.trail = []
+            #culprits of the last contradiction found by update
+            self.conflict = 0
             shape = grid.shape
             self.Width = shape[0]
             self.Height = shape[1]
 
-            #array that maps a coordinate in the crossword to which sequences overlap with it
-            self.ref = np.array([[(None,None) for x in range(self.Height)] for y in range(self.Width)], tuple)
-
-            #add horizontal sequences
+            #add horizontal and vertical sequences
             self.hor = []
-            for y in range(self.Height):
-                left = False
-                for x in range(self.Width - 1):
-                    current = self.Empty[x,y]
-                    right = self.Empty[x+1, y]
-                    if (left, current, right) == (False, True, True):
-                        #if this is the start of a new sequence
-                        #check length of sequence
-                        l = 0
-                        for value in self.Empty[x:, y]:
-                            if value:
-                                l += 1
-                            else:
-                                break
-
-                        cors = []
-                        for xcor in range(x, x+l):
-                            cors.append((xcor, y))
-                            self.ref[xcor, y][0] = len(self.hor)
-
-                        self.hor.append(Sequence(cors, 'hor', self))
-
-                    left = current
-
-            #add vertical sequences
             self.ver = []
-            for x in range(self.Width):
-                above = False
-                for y in range(self.Height - 1):
-                    current = self.Empty[x,y]
-                    below = self.Empty[x, y+1]
-                    if (above, current, below) == (False, True, True):
-                        #if this is the start of a new sequence
-                        #check length of sequence
-                        l = 0
-                        for value in self.Empty[x, y:]:
-                            if value:
-                                l += 1
-                            else:
-                                break
-
-                        cors = []
-                        for ycor in range(y, y+l):
-                            cors.append((x, ycor))
-                            self.ref[x, ycor][1] = len(self.ver)
-
-                        self.ver.append(Sequence(cors, 'ver', self))
-
-                    above = current
+            for cors, direction in slots(grid):
+                if direction == 'hor':
+                    self.hor.append(Sequence(cors, 'hor', self))
+                else:
+                    self.ver.append(Sequence(cors, 'ver', self))
+
+            self.Link()
 
     def InitFromCrossword(self, cw):
         """make a deep copy from another crossword"""
         self.Empty = copy.deepcopy(cw.Empty)
         self.Width = cw.Width
         self.Height = cw.Height
+        self.tiebreak = cw.tiebreak
         self.vocabdict = cw.vocabdict
+        self.index = cw.index
+        self.trail = []
+        self.conflict = 0
 
-        #array that maps a coordinate in the crossword to which sequences overlap with it
-        self.ref = np.array([[(None,None) for x in range(self.Height)] for y in range(self.Width)], tuple)
-
-
-        #add horizontal sequences
+        #copy sequences
         self.hor = [seq.Copy(self) for seq in cw.hor]
-        #add sequences to map
+        self.ver = [seq.Copy(self) for seq in cw.ver]
+        self.Link()
+
+    def Link(self):
+        """Number the sequences and build the lookup tables from fields to
+        sequences. The crossing table has a row for every sequence, which gives
+        for each field the id of the crossing sequence and the index of the field
+        in that sequence, or None if there is no crossing sequence."""
+        self.sequences = self.hor + self.ver
+        for k in range(len(self.sequences)):
+            self.sequences[k].id = k
+
+        #arrays that map a coordinate in the crossword to the sequences that overlap with it, -1 if none
+        self.horref = np.full((self.Width, self.Height), -1, dtype=int)
         for i in range(len(self.hor)):
-            s = self.hor[i]
-            for x, y in s.cors:
-                self.ref[x,y][0] = i
+            for x, y in self.hor[i].cors:
+                self.horref[x,y] = i
 
-        #add vertical sequences
-        self.ver = [seq.Copy(self) for seq in cw.ver]
-        #add sequences to map
+        self.verref = np.full((self.Width, self.Height), -1, dtype=int)
         for i in range(len(self.ver)):
-            s = self.ver[i]
-            for x, y in s.cors:
-                self.ref[x,y][1] = i
+            for x, y in self.ver[i].cors:
+                self.verref[x,y] = i
+
+        crossings = []
+        for seq in self.sequences:
+            row = []
+            for x, y in seq.cors:
+                otherseq = self.Seq(x, y, seq.otherdirection)
+                if otherseq:
+                    row.append((otherseq.id, otherseq.position[(x,y)]))
+                else:
+                    row.append(None)
+            crossings.append(tuple(row))
+        self.crossings = tuple(crossings)
+        self.degree = [sum(1 for c in row if c) for row in self.crossings]
+
+        #heap of the unfilled sequences, ordered by the size of their wordset
+        self.heap = Heap()
+        for seq in self.sequences:
+            self.Changed(seq)
+
+    def FillWords(self, words):
+        """Fill in a word for every sequence, in the order of self.sequences.
+        The words are not checked against each other."""
+        for seq, word in zip(self.sequences, words):
+            seq.Choose(word)
+
+    def Save(self, seq):
+        """Record the current state of a sequence on the trail, before it is changed."""
+        self.trail.append((seq, seq.mask, seq.letteroptions, seq.culprits))
+
+    def Mark(self):
+        """Return a marker for the current state, which can be passed to Undo."""
+        return len(self.trail)
+
+    def Undo(self, mark):
+        """Revert all changes made since the marker was made."""
+        trail = self.trail
+        changed = set()
+        while len(trail) > mark:
+            seq, mask, letteroptions, culprits = trail.pop()
+            seq.mask = mask
+            seq.letteroptions = letteroptions
+            seq.culprits = culprits
+            changed.add(seq)
+
+        for seq in changed:
+            self.Changed(seq)
+
+    def Changed(self, seq):
+        """Update the position of a sequence in the heap after its wordset has
+        changed. Sequences with one word left are not in the heap."""
+        count = seq.Count()
+        if count > 1:
+            if self.tiebreak == 'degree':
+                tie = -self.degree[seq.id]
+            elif self.tiebreak == 'entropy':
+                tie = sum(math.log2(len(options)) for options in seq.letteroptions)
+            else:
+                tie = 0
+            self.heap.Set(seq.id, (count, tie, seq.id))
+        else:
+            self.heap.Remove(seq.id)
 
     def Seq(self, x, y, direction):
         """Get the sequence that intersects with given coordinates on given direction"""
         if direction == 'hor':
-            if self.ref[x, y][0] != None:
-                return self.hor[self.ref[x, y][0]]
+            i = self.horref[x, y]
+            if i >= 0:
+                return self.hor[i]
             return None
         else:
-            if self.ref[x, y][1] != None:
-                return self.ver[self.ref[x, y][1]]
+            i = self.verref[x, y]
+            if i >= 0:
+                return self.ver[i]
             return None
 
     def Intersect(self, seq, i):
         """Get the sequence that intersects with input sequence's ith field."""
-        direction = seq.otherdirection
-        x,y = seq.cors[i]
-        return self.Seq(x, y, direction)
+        return self.Crossing(seq, i)[0]
+
+    def Crossing(self, seq, i):
+        """Get the sequence that intersects with input sequence's ith field, and
+        the index of that field in the intersecting sequence."""
+        crossing = self.crossings[seq.id][i]
+        if crossing:
+            k, j = crossing
+            return self.sequences[k], j
+        return None, None
+
+    def Arcs(self, seq, oldletteroptions):
+        """Return the arcs that need to be revised after the letter options of a
+        sequence have changed. An arc (otherseq, j) means that field j of otherseq
+        should be checked against the sequence crossing it."""
+        arcs = []
+        for i in range(len(seq)):
+            if seq.letteroptions[i] != oldletteroptions[i]:
+                otherseq, j = self.Crossing(seq, i)
+                if otherseq:
+                    arcs.append((otherseq, j))
+        return arcs
+
+    def Revise(self, seq, i):
+        """Remove the words from a sequence that do not fit the letter options of
+        the sequence crossing its ith field. Return the arcs that need to be
+        revised as a result."""
+        otherseq, j = self.Crossing(seq, i)
+        if otherseq:
+            letters = seq.letteroptions[i]
+            allowed = otherseq.letteroptions[j]
+            if not letters <= allowed:
+                oldletteroptions = seq.letteroptions
+                seq.SetMask(seq.mask & seq.index.LetterMask(i, letters & allowed), otherseq.culprits)
+                return self.Arcs(seq, oldletteroptions)
+        return []
 
     def UpdateSeq(self, seq):
-        """Update the wordset of a single sequence"""
+        """Update the wordset of a single sequence against all its crossings.
+        Return the arcs that need to be revised as a result."""
         if seq:
-            #loop through sequence's fields
-            oldletters = [options for options in seq.letteroptions]
-
-            for i in range(len(seq.cors)):
-                xcor, ycor = seq.cors[i]
-                #get intersecting sequence
-                otherseq = self.Intersect(seq, i)
-
-                if otherseq:
-                    #print('Checking position', i)
-                    to_delete = seq.Letters(xcor, ycor) - otherseq.Letters(xcor, ycor)
-                    #print('Excluding', to_delete)
-                    if len(to_delete) > 0:
-                        for letter in to_delete:
-                            seq.ExcludeLetter(i, letter)
-
-            #check if any intersecting sequences would be affected by this
-            affected = list()
-
+            arcs = []
             for i in range(len(seq)):
-                if seq.letteroptions[i] != oldletters[i]:
-                    otherseq = self.Intersect(seq, i)
-                    if otherseq:
-                        affected.append(otherseq)
-
-            #return list of newly affected sequences
-            return affected
+                arcs += self.Revise(seq, i)
+            return arcs
         else:
             return None
 
+    def Complete(self):
+        """Check whether every sequence has a single word left. Assumes that no
+        wordset is empty."""
+        return len(self.heap) == 0
+
+    def Next(self):
+        """Return the next sequence to be filled in: the sequence with the
+        smallest remaining wordset, using the heap."""
+        return self.sequences[self.heap.Min()]
+
     def NextSeq(self):
         """return coordinates of the next sequence to be filled in. Currently calculated as
         the sequence with the smallest remaining wordset."""
-        allsequences = self.hor + self.ver
-        candidates = set()
-        for seq in allsequences:
-            if len(seq.wordset) > 1:
-                candidates.add(seq)
-
-        sequence = min(candidates, key= lambda seq: len(seq.wordset))
+        sequence = self.Next()
         x, y = sequence.cors[0]
         direction = sequence.direction
         return (x, y, direction)
 
     def __str__(self):
         """Print function."""
-        strgrid = np.array([[' ' for x in range(self.Height)] for y in range(self.Width)], str)
+        strgrid = np.array([[' ' for x in range(self.Height)] for y in range(self.Width)], '<U2')
         for seq in self.hor+self.ver:
+            letters = tokenise(list(seq.wordset)[0])
             for i in range(len(seq.cors)):
                 x, y = seq.cors[i]
                 if strgrid[x, y] == ' ':
-                    strgrid[x,y] = list(seq.wordset)[0][i]
+                    strgrid[x,y] = letters[i]
 
         strgrid = strgrid.T
 
@@ -318,88 +623,411 @@ class Crossword:
 #-------------------------------------------------------------------------------
 
 def update(queue, crossword):
-    """update the crossword, given a queue"""
-    if len(queue) > 0:
-        #pop first sequence
-        seq = queue[0]
-        if seq:
-            x, y = seq.cors[0]
-            direction = seq.direction
+    """Update the crossword, given a queue of sequences or arcs to revise.
+
+    Propagation works through a worklist of arcs (AC-3). An arc (seq, i) is
+    revised by checking field i of seq against the crossing sequence, and only
+    the arcs of fields whose letter options changed are added again. Each arc is
+    in the worklist at most once. Returns False if a wordset becomes empty; the
+    culprits of that wordset are then stored in crossword.conflict."""
+    worklist = deque()
+    queued = set()
+
+    def push(arc):
+        if arc not in queued:
+            queued.add(arc)
+            worklist.append(arc)
+
+    for item in queue:
+        if type(item) == tuple:
+            push(item)
+        elif item:
+            #a sequence on the queue means all its fields are checked
+            if item.mask == 0:
+                crossword.conflict = item.culprits
+                return False
+            for i in range(len(item)):
+                push((item, i))
 
-            #update sequence's wordlist
-            neighbours = crossword.UpdateSeq(seq)
+    while worklist:
+        arc = worklist.popleft()
+        queued.discard(arc)
+        seq, i = arc
 
-            #check if this led to a contradiction
-            wordsleft = len(seq.wordset)
-            if wordsleft > 0:
-                if neighbours:
-                    newqueue = queue[1:] + neighbours
-                else:
-                    newqueue = queue[1:]
-                return update(newqueue, crossword)
-            else:
-                return False
-        else:
-            return update(queue[1:], crossword)
-    else:
-        #if the queue is empty, then we're done
-        return True
+        newarcs = crossword.Revise(seq, i)
 
+        #check if this led to a contradiction
+        if seq.mask == 0:
+            crossword.conflict = seq.culprits
+            return False
 
-def FillIn(sequencelist, crossword):
-    """Recursive function that fills in words in sequences"""
+        for newarc in newarcs:
+            push(newarc)
 
-    #try to update
-    updated = update(sequencelist, crossword)
+    #if the worklist is empty, then we're done
+    return True
 
-    if updated:
-        #check if the crossword is now completely filled in
-        complete = True
-        for seq in crossword.hor + crossword.ver:
-            if len(seq.wordset) > 1:
-                complete = False
 
-        if complete:
-            #if the crossword is now complete
-            return crossword
+class Nogoods:
+    """Choices that are known not to be part of any solution. A unit is a single
+    (sequence id, word) choice, a pair is a combination of two such choices.
+    Nogoods only hold for the grid and vocabulary they were learned on, but
+    they stay valid for the rest of the run, including restarts."""
 
+    def __init__(self):
+        self.units = set()
+        self.pairs = dict()
+
+    def __len__(self):
+        return len(self.units) + sum(len(partners) for partners in self.pairs.values()) // 2
+
+    def Add(self, choices):
+        """Learn a nogood from a list of choices. Only units and pairs are kept."""
+        if len(choices) == 1:
+            self.units.add(choices[0])
+        elif len(choices) == 2:
+            a, b = choices
+            self.pairs.setdefault(a, set()).add(b)
+            self.pairs.setdefault(b, set()).add(a)
+
+    def Partners(self, k, word):
+        """Return the choices that can't be combined with the given choice."""
+        return self.pairs.get((k, word), ())
+
+    def State(self):
+        """Export as plain python values."""
+        pairs = [[a[0], a[1], b[0], b[1]] for a in self.pairs for b in self.pairs[a] if a < b]
+        return {'units': sorted([k, word] for k, word in self.units), 'pairs': sorted(pairs)}
+
+    def FromState(state):
+        """Rebuild nogoods from the output of State."""
+        nogoods = Nogoods()
+        for k, word in state['units']:
+            nogoods.Add([(k, word)])
+        for k1, word1, k2, word2 in state['pairs']:
+            nogoods.Add([(k1, word1), (k2, word2)])
+        return nogoods
+
+class Search:
+    """Depth-first search for a solution of a crossword.
+
+    The search does not recurse: every choice is a frame on an explicit stack,
+    and choices that fail are undone with the crossword's trail. The search
+    can be paused by giving Run a budget, and its state can be exported with
+    State and continued later with Resume.
+
+    The choice at depth d has decision level d + 1. Each sequence keeps the
+    levels that shrank its wordset (its culprits), so a contradiction comes with
+    the set of choices that caused it. With backjump, the search undoes all
+    choices up to the most recent culprit, instead of only the last choice, and
+    learns nogoods from contradictions with one or two culprits."""
+
+    def __init__(self, crossword, queue=None, seed=None, order='random', backjump=False, nogoods=None):
+        """The order decides which word is tried first for a sequence: 'random',
+        'lcv' (least constraining value, see Support), 'score' (the word with
+        the best score in the vocabulary index) or 'weighted' (random, with a
+        probability proportional to the score)."""
+        self.cw = crossword
+        self.order = order
+        self.backjump = backjump
+        if nogoods is None:
+            nogoods = Nogoods()
+        self.nogoods = nogoods
+        self.sequences = crossword.sequences
+        if queue is None:
+            queue = self.sequences
+        self.queue = queue
+        self.rng = random.Random(seed)
+        #Fenwick trees for order 'weighted', by sequence id
+        self.samplers = dict()
+
+        #each frame is (mark, sequence id, word) for a choice that is in place
+        self.stack = []
+        #refuted[d] lists the (sequence id, word, culprits) exclusions at depth d
+        self.refuted = [[]]
+        self.nodes = 0
+        self.backtracks = 0
+        self.status = 'new'
+
+    def Choose(self, seq, word):
+        """Fill in a word at the next decision level and propagate. Returns False
+        on a contradiction."""
+        level = 1 << len(self.stack)
+        queue = seq.Choose(word, level)
+
+        #remove the word for other sequences to prevent duplicates, and remove
+        #the choices that form a nogood with this one
+        forbidden = [(s, word) for s in self.sequences if len(s) == len(seq) and s != seq]
+        forbidden += [(self.sequences[k], other) for k, other in self.nogoods.Partners(seq.id, word)]
+
+        for s, w in forbidden:
+            if s.Has(w):
+                queue += s.ExcludeWord(w, level)
+                if s.mask == 0:
+                    self.cw.conflict = s.culprits
+                    return False
+
+        return update(queue, self.cw)
+
+    def Exclude(self, seq, word, culprits=0):
+        """Remove a word from a sequence and propagate. Returns False on a
+        contradiction."""
+        queue = seq.ExcludeWord(word, culprits)
+        if seq.mask == 0:
+            self.cw.conflict = seq.culprits
+            return False
+        return update(queue, self.cw)
+
+    def Push(self, seq, word):
+        """Make a choice on top of the stack."""
+        self.stack.append((self.cw.Mark(), seq.id, word))
+        self.refuted.append([])
+        return self.Choose(seq, word)
+
+    def Backtrack(self):
+        """Undo choices after a contradiction and exclude the last choice that was
+        undone. Returns False on a new contradiction. Sets the status to 'failed'
+        if there is no choice left to undo."""
+        conflict = self.cw.conflict
+        if self.backjump:
+            #jump back to the most recent choice that caused the contradiction
+            level = conflict.bit_length() - 1
+            self.Learn(conflict)
         else:
-            #if the crossword is not yet complete
-            #select the next sequence to change
-            new_x, new_y, new_dir = crossword.NextSeq()
-            sequence = crossword.Seq(new_x, new_y, new_dir)
-
-            wordsetsize = len(crossword.Seq(new_x, new_y, new_dir))
-
-            #select the next word to try
-            wordchoice = random.choice(list(sequence.wordset))
-
-            #create copy of the crossword
-            newcw = copy.deepcopy(Crossword(crossword))
-            newseq = newcw.Seq(new_x, new_y, new_dir)
-            neighbours = newseq.Choose(wordchoice)
-
-            #remove the word for other sequences to prevent duplicates
-            for s in newcw.hor+newcw.ver:
-                if len(s) == len(newseq) and s != newseq:
-                    if wordchoice in s.wordset:
-                        s.ExcludeWord(wordchoice)
-                        for i in range(len(s)):
-                            neighbours.append(newcw.Intersect(s, i))
-
-            #check the resulting crossword
-            filled_in = FillIn(neighbours, newcw)
-
-            if filled_in:
-                #if you were able to complete the crossword
-                return filled_in
+            level = len(self.stack)
+
+        if level <= 0:
+            self.status = 'failed'
+            return False
+
+        self.backtracks += 1
+
+        while len(self.stack) >= level:
+            mark, k, word = self.stack.pop()
+            self.refuted.pop()
+        self.cw.Undo(mark)
+
+        #the exclusion is caused by the other choices in the conflict
+        culprits = conflict & ~(1 << level)
+        self.refuted[-1].append((k, word, culprits))
+        return self.Exclude(self.sequences[k], word, culprits)
+
+    def Learn(self, conflict):
+        """Store the choices in a conflict as a nogood."""
+        if 0 < popcount(conflict) <= 2:
+            levels = ids(conflict, conflict.bit_length())
+            self.nogoods.Add([self.stack[level - 1][1:] for level in levels])
+
+    def Support(self, seq, candidates):
+        """Score candidate words (given as ids) by how many words they leave in
+        the crossing sequences. The score is the sum over the crossings of the
+        log of the number of crossing words that have the same letter."""
+        index = seq.index
+        scores = np.zeros(len(candidates))
+        for i in range(len(seq)):
+            otherseq, j = self.cw.Crossing(seq, i)
+            if otherseq:
+                support = np.zeros(len(index.alphabet))
+                for letter in seq.letteroptions[i]:
+                    support[letter] = popcount(otherseq.mask & otherseq.index.masks[j].get(letter, 0))
+                with np.errstate(divide='ignore'):
+                    scores += np.log(support)[index.codes[candidates, i]]
+        return scores
+
+    def Pick(self, seq):
+        """Select the next word to try for a sequence."""
+        if self.order == 'score':
+            #words are sorted by score, so the lowest bit is the best word
+            return seq.index.words[(seq.mask & -seq.mask).bit_length() - 1]
+
+        if self.order == 'weighted':
+            sampler = self.samplers.get(seq.id)
+            if sampler is None:
+                sampler = self.samplers[seq.id] = Fenwick(seq.index.scores, seq.mask)
+            else:
+                sampler.Sync(seq.mask)
+            return seq.index.words[sampler.Sample(self.rng.random())]
+
+        if self.order == 'lcv':
+            #try the word that leaves most options for the crossing sequences
+            candidates = ids(seq.mask, seq.index.n)
+            scores = self.Support(seq, candidates)
+            candidates = candidates[scores == scores.max()]
+            return seq.index.words[self.rng.choice(candidates)]
+
+        #a random live word, found without listing the others
+        return seq.index.words[nthBit(seq.mask, self.rng.randrange(popcount(seq.mask)))]
+
+    def Run(self, max_nodes=None, max_backtracks=None, timeout=None):
+        """Search until the crossword is filled in, the search space is exhausted,
+        or the budget is used up: max_nodes choices, max_backtracks backtracks or
+        timeout seconds. Returns the filled in crossword, or None. The status
+        attribute tells whether the search was 'solved', 'failed', or paused
+        ('running')."""
+        cw = self.cw
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        backtracks = self.backtracks
+
+        if self.status == 'new':
+            if update(self.queue, cw):
+                self.status = 'running'
+                self.ExcludeUnits()
             else:
-                #if you weren't, exclude this choice
-                neighbours = sequence.ExcludeWord(wordchoice)
+                self.status = 'failed'
+
+        nodes = 0
+        while self.status == 'running':
+            if cw.Complete():
+                self.status = 'solved'
+                break
+
+            if max_nodes is not None and nodes >= max_nodes:
+                return None
+            if max_backtracks is not None and self.backtracks - backtracks >= max_backtracks:
+                return None
+            if timeout is not None and time.monotonic() >= deadline:
+                return None
+
+            #select the next sequence and word to try
+            seq = cw.Next()
+            word = self.Pick(seq)
+            nodes += 1
+            self.nodes += 1
+
+            ok = self.Push(seq, word)
+
+            #on a contradiction, undo choices until one can be excluded
+            while not ok and self.status == 'running':
+                ok = self.Backtrack()
+
+        if self.status == 'solved':
+            return cw
+        return None
 
-                #solve the crossword with this choice excluded
-                return FillIn(neighbours, crossword)
+    def ExcludeUnits(self):
+        """Exclude the words of learned units before the first choice."""
+        for k, word in sorted(self.nogoods.units):
+            seq = self.sequences[k]
+            if seq.Has(word):
+                self.refuted[0].append((k, word, 0))
+                if not self.Exclude(seq, word):
+                    self.status = 'failed'
+                    return
+
+    def State(self):
+        """Export the state of the search as a dict of plain python values, which
+        can be stored with json or pickle."""
+        version, internal, gauss = self.rng.getstate()
+        return {
+            'grid': np.asarray(self.cw.Empty).astype(int).tolist(),
+            'decisions': [[k, word] for mark, k, word in self.stack],
+            'refuted': [[list(exclusion) for exclusion in refuted] for refuted in self.refuted],
+            'order': self.order,
+            'backjump': self.backjump,
+            'tiebreak': self.cw.tiebreak,
+            'nogoods': self.nogoods.State(),
+            'rng': [version, list(internal), gauss],
+            'nodes': self.nodes,
+            'backtracks': self.backtracks,
+            'status': self.status,
+        }
+
+    def Resume(state, crossword):
+        """Rebuild a search from its state. The crossword should be a fresh
+        crossword made from the same grid, vocabulary and tiebreak, for instance
+        Crossword(np.array(state['grid'], bool), vocab, tiebreak=state['tiebreak']).
+        Nogoods are only applied to choices made after resuming."""
+        if crossword.tiebreak != state.get('tiebreak'):
+            raise ValueError('search state was made with tiebreak %r, not %r'
+                             % (state.get('tiebreak'), crossword.tiebreak))
+        search = Search(crossword, order=state['order'], backjump=state['backjump'])
+        version, internal, gauss = state['rng']
+        search.rng.setstate((version, tuple(internal), gauss))
+        search.nodes = state['nodes']
+        search.backtracks = state['backtracks']
+        search.status = state['status']
+
+        if search.status != 'new':
+            #replay the refutations and choices at every depth
+            ok = update(search.sequences, crossword)
+            decisions = state['decisions']
+            for d, refuted in enumerate(state['refuted']):
+                for k, word, culprits in refuted:
+                    search.refuted[-1].append((k, word, culprits))
+                    ok = ok and search.Exclude(search.sequences[k], word, culprits)
+                if d < len(decisions):
+                    k, word = decisions[d]
+                    ok = ok and search.Push(search.sequences[k], word)
+
+            if not ok and search.status == 'running':
+                raise ValueError('search state does not match the crossword')
+
+        search.nogoods = Nogoods.FromState(state['nogoods'])
+        return search
+
+def luby(i):
+    """The ith element (counting from 1) of the Luby sequence 1, 1, 2, 1, 1, 2,
+    4, 1, 1, 2, 1, 1, 2, 4, 8, ..."""
+    while True:
+        k = i.bit_length()
+        if i == (1 << k) - 1:
+            return 1 << (k - 1)
+        i -= (1 << (k - 1)) - 1
+
+def FillIn(sequencelist, crossword, order='random', backjump=False, restarts=None,
+           scale=100, timeout=None, max_backtracks=None, seed=None, keep_nogoods=True):
+    """Fill in words in sequences. The crossword is changed in place: choices
+    that fail are undone using the crossword's trail. Returns the filled in
+    crossword, or None if it can't be filled in.
+
+    The total search can be limited to timeout seconds or max_backtracks
+    backtracks, after which None is returned as well and the crossword is reset
+    to its state before the search. With restarts ('luby' or
+    'geometric'), the nth search gets a budget of scale * luby(n) or
+    scale * 1.5 ** (n-1) backtracks. When the budget is used up, the crossword
+    is reset and the search starts over with a new seed. With keep_nogoods,
+    nogoods learned by backjumping are kept for the next search. See Search for
+    the order of the words."""
+    rng = random.Random(seed)
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
+    mark = crossword.Mark()
+    nogoods = Nogoods()
+    queue = sequencelist
+    used = 0
+
+    n = 1
+    while True:
+        if restarts == 'luby':
+            budget = scale * luby(n)
+        elif restarts == 'geometric':
+            budget = int(scale * 1.5 ** (n - 1))
+        else:
+            budget = None
 
-    else:
-        #if the update revealed a contradiction
-        return None
+        if max_backtracks is not None:
+            if budget is None or used + budget > max_backtracks:
+                budget = max_backtracks - used
+        if timeout is not None:
+            remaining = deadline - time.monotonic()
+        else:
+            remaining = None
+
+        search = Search(crossword, queue, seed=rng.random(), order=order, backjump=backjump, nogoods=nogoods)
+        solved = search.Run(max_backtracks=budget, timeout=remaining)
+        used += search.backtracks
+
+        if search.status != 'running':
+            return solved
+
+        #start over from the state before the first search
+        crossword.Undo(mark)
+        if max_backtracks is not None and used >= max_backtracks:
+            return None
+        if timeout is not None and time.monotonic() >= deadline:
+            return None
+        queue = crossword.sequences
+        if not keep_nogoods:
+            nogoods = Nogoods()
+        n += 1
@@ -3,7 +3,8 @@
 # annealing to find a good crossword in a random walk through all boolean grids.
 
 # Note: the expression generateEmpty() generates a new grid that satisfies all
-# constraints.
+# constraints. generateEmpty(spec=GridSpec(...)) does the same for other sizes,
+# symmetries and annealing settings.
 
 #-------------------------------------------------------------------------------
 ### IMPORT
@@ -12,6 +13,7 @@
 import numpy as np
 import random
 import math
+import multiprocessing
 
 if __name__ == '__main__':
     #for viewing
@@ -19,16 +21,95 @@ if __name__ == '__main__':
     from PIL import Image, ImageDraw
     import matplotlib.pyplot as plt
 
+#%%
+#-------------------------------------------------------------------------------
+### SETTINGS
+#-------------------------------------------------------------------------------
+
+# The names of the constraints, used as keys for their weights in the loss
+CONSTRAINTS = ['minLength', 'islands', 'blackWhiteBalance', 'lengthBalance', 'maxLength', 'whiteBlocks', 'wordSupply']
+
+class GridSpec:
+    """Settings for generating an empty grid.
+
+    width, height: size of the grid. The height is the same as the width by default.
+    symmetry: 'point' (rotating the grid by 180 degrees), 'horizontal' (mirroring
+        left to right), 'vertical' (mirroring top to bottom) or 'none'.
+    iterations: maximum number of annealing steps per call of colour.
+    cooling: temperature schedule, 'harmonic' (T0 / (i + 1)), 'geometric'
+        (T0 * rate ** i) or 'linear' (T0 * (1 - i / iterations)).
+    temperature: the starting temperature T0. The default is the number of iterations.
+    rate: cooling rate of the geometric schedule.
+    weights: weights of the constraints in the loss, by name. Missing constraints have weight 1.
+    min_length: minimum length of a sequence.
+    block_size, max_blocks: at most max_blocks blocks of block_size x block_size white squares.
+    supply: number of words in the vocabulary for every length, see wordSupply.
+        Without a supply, the vocabulary is not taken into account.
+    min_supply: the minimum number of words of a length for a sequence of that length.
+    """
+
+    def __init__(self, width=13, height=None, symmetry='point', iterations=2000, cooling='harmonic',
+                 temperature=None, rate=0.995, weights=None, min_length=3, block_size=3, max_blocks=2,
+                 supply=None, min_supply=10):
+        self.width = width
+        self.height = height if height is not None else width
+        self.symmetry = symmetry
+        self.iterations = iterations
+        self.cooling = cooling
+        self.temperature = temperature if temperature is not None else iterations
+        self.rate = rate
+        self.weights = {name: 1 for name in CONSTRAINTS}
+        if weights:
+            self.weights.update(weights)
+        self.min_length = min_length
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.supply = supply
+        self.min_supply = min_supply
+
+    def Partners(self, y, x):
+        """The squares that have to be the same colour as the given square, including itself"""
+        height, width = self.height, self.width
+        if self.symmetry == 'point':
+            cells = [(y, x), (height - 1 - y, width - 1 - x)]
+        elif self.symmetry == 'horizontal':
+            cells = [(y, x), (y, width - 1 - x)]
+        elif self.symmetry == 'vertical':
+            cells = [(y, x), (height - 1 - y, x)]
+        else:
+            cells = [(y, x)]
+        return cells
+
+    def Temperature(self, i):
+        """Temperature at annealing step i"""
+        if self.cooling == 'geometric':
+            T = self.temperature * self.rate ** i
+        elif self.cooling == 'linear':
+            T = self.temperature * (1 - i / self.iterations)
+        else:
+            T = self.temperature / (i + 1)
+        return max(T, 1e-9)
+
+    def Weigh(self, violations):
+        """Weighted sum of a dict of violations per constraint"""
+        return sum(self.weights[name] * value for name, value in violations.items())
+
 #%%
 #-------------------------------------------------------------------------------
 ### INITIATE CROSSWORD
 #-------------------------------------------------------------------------------
 
-def makeGrid(size):
-    grid = np.rint(np.random.rand(size, size)).astype(bool)
+def makeGrid(size, height=None, symmetry='point', rng=None):
+    'a random grid. rng is a numpy Generator, by default the global numpy random state is used'
+    if height is None:
+        height = size
+    spec = GridSpec(size, height, symmetry)
+    values = rng.random((height, size)) if rng is not None else np.random.rand(height, size)
+    grid = np.rint(values).astype(bool)
     for x in range(size):
-        for y in range(size):
-            grid[y,x] = grid[-(y + 1),-(x + 1)]
+        for y in range(height):
+            for y_1, x_1 in spec.Partners(y, x):
+                grid[y_1,x_1] = grid[y,x]
 
     return grid
 
@@ -74,6 +155,22 @@ def seqLength(x,y,grid,direction):
 
     return(len(rest))
 
+def runs(grid):
+    'gives the lengths of all runs of white squares in the rows of the grid, including runs of length 1'
+    #pad every row with a black square on both ends, so each run has a start and an end
+    padded = np.zeros((grid.shape[0], grid.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = grid
+    steps = np.diff(padded, axis=1)
+    starts = np.nonzero(steps == 1)[1]
+    ends = np.nonzero(steps == -1)[1]
+    return ends - starts
+
+def seqLengths(grid):
+    'gives the lengths of all horizontal and vertical sequences in one array, found with array operations'
+    lengths = np.concatenate([runs(grid), runs(grid.T)])
+    #a single white square is not a sequence
+    return lengths[lengths > 1]
+
 #%%
 #-------------------------------------------------------------------------------
 ### CONSTRAINTS
@@ -83,53 +180,104 @@ def seqLength(x,y,grid,direction):
 # function takes an empty crossword as input, and outputs the number of
 # violations of the constraint.
 
-def minLength(grid, min_length=3):
+# The constraints on sequence lengths can be given the output of seqLengths, so
+# it only needs to be computed once per grid.
+
+def minLength(grid, min_length=3, lengths=None):
     'returns number of sequences that are shorter than the minimum length'
-    lengths = [seqLength(x,y,grid, direction) for direction in ('hor', 'ver') for y,x in startingCors(grid, direction)]
+    if lengths is None:
+        lengths = seqLengths(grid)
 
-    violations = len([l for l in lengths if l < min_length])
+    violations = int(np.sum(lengths < min_length))
 
     return violations
 
 def neighbours(x,y,grid):
     'give coordinates of neighbours in von neumann neighbouhood for which the square is True in the grid'
-    size = grid.shape[0]
+    height, width = grid.shape
     neighbourhood = [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]
-    neighbourhood = [(x_1, y_1) for x_1, y_1 in neighbourhood if x_1 >= 0 and x_1 < size and y_1 >= 0 and y_1 < size]
+    neighbourhood = [(x_1, y_1) for x_1, y_1 in neighbourhood if x_1 >= 0 and x_1 < width and y_1 >= 0 and y_1 < height]
     return [(x_1,y_1) for x_1, y_1 in neighbourhood if grid[y_1,x_1]]
 
+class Components:
+    """Union-find structure over the white squares of a grid, to count islands.
+
+    Squares are numbered y * width + x. Black squares are always single roots.
+    White squares can be added one at a time, and additions can be undone with
+    Mark and Undo. Removing a white square is not supported: make a new
+    Components for the new grid instead."""
+
+    def __init__(self, grid):
+        height, width = grid.shape
+        self.width = width
+        self.parent = list(range(height * width))
+        self.size = [1] * (height * width)
+        self.count = int(np.sum(grid))
+        self.trail = []
+
+        #pairs of neighbouring white squares, found with array operations
+        ys, xs = np.nonzero(grid[:, :-1] & grid[:, 1:])
+        for a in (ys * width + xs).tolist():
+            self.Union(a, a + 1)
+        ys, xs = np.nonzero(grid[:-1, :] & grid[1:, :])
+        for a in (ys * width + xs).tolist():
+            self.Union(a, a + width)
+
+        self.trail = []
+
+    def Find(self, a):
+        parent = self.parent
+        while parent[a] != a:
+            a = parent[a]
+        return a
+
+    def Union(self, a, b):
+        a, b = self.Find(a), self.Find(b)
+        if a != b:
+            #attach the smaller tree, so trees stay shallow without path compression
+            if self.size[a] < self.size[b]:
+                a, b = b, a
+            self.parent[b] = a
+            self.size[a] += self.size[b]
+            self.count -= 1
+            self.trail.append((b, a))
+
+    def Add(self, grid, y, x):
+        """Add a square that has just turned white in the grid"""
+        a = y * self.width + x
+        self.count += 1
+        self.trail.append((a,))
+        for x_1, y_1 in neighbours(x, y, grid):
+            self.Union(a, y_1 * self.width + x_1)
+
+    def Mark(self):
+        return len(self.trail)
+
+    def Undo(self, mark):
+        """Undo all additions since the mark"""
+        while len(self.trail) > mark:
+            change = self.trail.pop()
+            if len(change) == 1:
+                self.count -= 1
+            else:
+                b, a = change
+                self.parent[b] = b
+                self.size[a] -= self.size[b]
+                self.count += 1
+
 def islands(grid):
     'return the number of islands - 1. (There should be only 1.)'
-    size = grid.shape[0]
-    islands = 0
-    new_grid = np.copy(grid)
-    for x in range(size):
-        for y in range(size):
-            if new_grid[y,x]:
-                #add one to count
-                islands += 1
-
-                #set rest of island to False
-                connected = neighbours(x,y,new_grid)
-                while len(connected) > 0:
-                    x_1, y_1 = connected[0]
-                    if new_grid[y_1, x_1]:
-                        #set to false and append its neighbours
-                        new_grid[y_1,x_1] = False
-                        connected = connected[1:] + neighbours(x_1, y_1, new_grid)
-                    else:
-                        #or just delete it
-                        connected = connected[1:]
-
-    return islands - 1
+    return Components(grid).count - 1
 
 def blackWhiteBalance(grid):
     'checks that at most 80% of squares are white and at most 30% are black. returns the overflow in either direction.'
-    size = grid.shape[0]
-    total_count = size ** 2
+    total_count = grid.size
+
+    return balanceOverflow(int(np.sum(grid)), total_count)
 
+def balanceOverflow(white_count, total_count):
+    'the overflow of blackWhiteBalance, given the number of white squares and the total number of squares'
     max_white = int(0.8 * total_count)
-    white_count = np.sum(grid)
     overflow = max(white_count - max_white, 0)
 
     if not overflow:
@@ -139,41 +287,267 @@ def blackWhiteBalance(grid):
 
     return overflow
 
-def lengthBalance(grid):
+def lengthBalance(grid, lengths=None):
     'checks that there are not too many sequences of length three.'
-    lengths = [seqLength(x,y,grid, direction) for direction in ('hor', 'ver') for y,x in startingCors(grid, direction)]
-    threes = filter(lambda x: x == 3, lengths)
+    if lengths is None:
+        lengths = seqLengths(grid)
+    threes = int(np.sum(lengths == 3))
 
     max_threes = int(0.3 * len(lengths))
-    overflow = max(0, sum(threes)/3 - max_threes)
+    overflow = max(0, threes - max_threes)
 
     return overflow
 
-def maxLength(grid):
+def maxLength(grid, lengths=None):
     "a random walk favours short word lengths. this constraints checks that there are at least a few longer ones"
     min_length = 9
     min_count = 3
 
-    lengths = [seqLength(x,y,grid, direction) for direction in ('hor', 'ver') for y,x in startingCors(grid, direction)]
-    long_count = sum(1 for l in lengths if l >= min_length)
+    if lengths is None:
+        lengths = seqLengths(grid)
+    long_count = int(np.sum(lengths >= min_length))
     defecit = max(0, min_count - long_count)
 
     return defecit
 
-def whiteBlocks(grid):
-    'limits the number of 3x3 blocks that are only white squares. maximum is 2.'
-    size = grid.shape[0]
-
-    is_block = lambda x, y: np.all(grid[y : y+3, x : x+3])
+def windowSums(grid, k=3):
+    'gives the number of white squares in every kxk window, indexed by top left corner, using a summed-area table'
+    height, width = grid.shape
+    table = np.zeros((height + 1, width + 1), dtype=int)
+    table[1:, 1:] = np.cumsum(np.cumsum(grid, axis=0), axis=1)
+    return table[k:, k:] - table[:-k, k:] - table[k:, :-k] + table[:-k, :-k]
+
+def whiteBlocks(grid, k=3, max_blocks=2):
+    'limits the number of kxk blocks that are only white squares. returns the number of blocks over the maximum.'
+    blocks = int(np.sum(windowSums(grid, k) == k * k))
+
+    return max(0, blocks - max_blocks)
+
+def supplyViolations(counts, supply, min_supply=10):
+    'the violations of wordSupply, given the number of sequences of every length'
+    violations = 0
+    for l, n in counts.items():
+        available = supply.get(l, 0)
+        if available < min_supply:
+            violations += n
+        violations += max(0, n - available)
+    return violations
 
-    blocks = sum(int(is_block(x,y)) for x in range(size - 3) for y in range(size - 3))
+def wordSupply(grid, supply, min_supply=10, lengths=None):
+    '''checks that the vocabulary has enough words for the sequences. supply gives
+    the number of words for every length. every sequence of a length with fewer
+    than min_supply words is a violation, and so is every sequence of a length
+    beyond the number of words, since a word can only be used once.'''
+    if lengths is None:
+        lengths = seqLengths(grid)
+    values, counts = np.unique(lengths, return_counts=True)
+    return supplyViolations(dict(zip(values.tolist(), counts.tolist())), supply, min_supply)
+
+def fillable(grid, spec=None):
+    'a quick check whether the vocabulary of the spec has enough words to fill in the grid, before it goes to the filler'
+    if spec is None or spec.supply is None:
+        return True
+    return wordSupply(grid, spec.supply, spec.min_supply) == 0
+
+def violations(grid, spec=None):
+    """Violations of every constraint, by name"""
+    if spec is None:
+        spec = GridSpec()
+    lengths = seqLengths(grid)
+    return {
+        'minLength': minLength(grid, spec.min_length, lengths=lengths),
+        'islands': islands(grid),
+        'blackWhiteBalance': blackWhiteBalance(grid),
+        'lengthBalance': lengthBalance(grid, lengths=lengths),
+        'maxLength': maxLength(grid, lengths=lengths),
+        'whiteBlocks': whiteBlocks(grid, spec.block_size, spec.max_blocks),
+        'wordSupply': wordSupply(grid, spec.supply, spec.min_supply, lengths) if spec.supply is not None else 0,
+    }
+
+def loss(grid, spec=None):
+    """Weighted sum of violations for all constraints"""
+    if spec is None:
+        spec = GridSpec()
+    return spec.Weigh(violations(grid, spec))
 
-    return blocks - 2
+#%%
+#-------------------------------------------------------------------------------
+### INCREMENTAL LOSS
+#-------------------------------------------------------------------------------
 
-def loss(grid):
-    """Sum of violations for all constraints"""
-    constraints =  [minLength, islands, blackWhiteBalance, lengthBalance, maxLength, whiteBlocks]
-    return sum(f(grid) for f in constraints)
+# The annealer only changes two squares per step, so computing the loss of the
+# whole grid for every step is wasteful. A GridState keeps statistics for every
+# row, column and kxk window, and after a change it only updates the rows,
+# columns and windows that contain the changed squares.
+#
+# The rows and columns are also kept as bitmasks: a python int in which bit x of
+# row y (and bit y of column x) is set if the square is white. Flipping a square
+# is then an XOR, and runs and blocks of white squares are found with bit tricks.
+
+def toBits(grid):
+    'the rows and the columns of a grid as lists of bitmasks'
+    rows = [sum(1 << x for x in np.flatnonzero(row).tolist()) for row in grid]
+    cols = [sum(1 << y for y in np.flatnonzero(col).tolist()) for col in grid.T]
+    return rows, cols
+
+def fromBits(rows, width):
+    'the grid of a list of row bitmasks'
+    return np.array([[bool(row >> x & 1) for x in range(width)] for row in rows], dtype=bool)
+
+def maskLengths(mask):
+    'lengths of the sequences in a row or column bitmask'
+    lengths = []
+    while mask:
+        low = mask & -mask
+        #adding the lowest bit clears the lowest run of ones and sets the bit after it
+        run = mask & ~(mask + low)
+        l = run.bit_count()
+        if l > 1:
+            lengths.append(l)
+        mask ^= run
+    return lengths
+
+def maskBlocks(mask, k=3):
+    'bitmask of the squares in a row that start k white squares in a row'
+    blocks = mask
+    for i in range(1, k):
+        blocks &= mask >> i
+    return blocks
+
+def lineStats(lengths, min_length=3):
+    'statistics of the sequence lengths of one row or column: [number of sequences, shorter than min_length, of length 3, of length 9 or more]'
+    stats = [len(lengths), 0, 0, 0]
+    for l in lengths:
+        stats[1] += l < min_length
+        stats[2] += l == 3
+        stats[3] += l >= 9
+    return stats
+
+class GridState:
+    def __init__(self, grid, spec=None):
+        if spec is None:
+            height, width = grid.shape
+            spec = GridSpec(width, height)
+        self.spec = spec
+        self.grid = np.copy(grid)
+        self.k = spec.block_size
+        height, width = grid.shape
+        self.rows, self.cols = toBits(self.grid)
+
+        #sequence lengths and statistics per row and column, and their totals
+        self.rowlengths = [maskLengths(row) for row in self.rows]
+        self.collengths = [maskLengths(col) for col in self.cols]
+        self.rowstats = [lineStats(lengths, spec.min_length) for lengths in self.rowlengths]
+        self.colstats = [lineStats(lengths, spec.min_length) for lengths in self.collengths]
+        self.totals = [sum(stats[k] for stats in self.rowstats + self.colstats) for k in range(4)]
+
+        #number of sequences of every length
+        self.counts = dict()
+        for lengths in self.rowlengths + self.collengths:
+            for l in lengths:
+                self.counts[l] = self.counts.get(l, 0) + 1
+
+        self.white = int(np.sum(self.grid))
+
+        #starts of k white squares per row, and the number of kxk blocks per top row
+        self.starts = [maskBlocks(row, self.k) for row in self.rows]
+        self.blockrows = [self.BlockRow(y) for y in range(height - self.k + 1)]
+        self.blocks = sum(self.blockrows)
+
+        self.components = Components(self.grid)
+        self.islands = self.components.count - 1
+        self.loss = self.Loss()
+        self.last = None
+
+    def Violations(self):
+        """Violations of every constraint, the same as violations(self.grid, self.spec)"""
+        count, short, threes, long_count = self.totals
+        return {
+            'minLength': short,
+            'islands': self.islands,
+            'blackWhiteBalance': balanceOverflow(self.white, self.grid.size),
+            'lengthBalance': max(0, threes - int(0.3 * count)),
+            'maxLength': max(0, 3 - long_count),
+            'whiteBlocks': max(0, self.blocks - self.spec.max_blocks),
+            'wordSupply': supplyViolations(self.counts, self.spec.supply, self.spec.min_supply) if self.spec.supply is not None else 0,
+        }
+
+    def Loss(self):
+        """Weighted sum of violations for all constraints, the same as loss(self.grid, self.spec)"""
+        return self.spec.Weigh(self.Violations())
+
+    def BlockRow(self, y):
+        """Number of kxk blocks of white squares with their top row at y"""
+        blocks = self.starts[y]
+        for y_1 in range(y + 1, y + self.k):
+            blocks &= self.starts[y_1]
+        return blocks.bit_count()
+
+    def Set(self, y, x, value):
+        """Set a square to a value and update the statistics around it. Returns
+        whether the square has changed. Does not update the islands."""
+        if (self.rows[y] >> x & 1) == value:
+            return False
+        self.grid[y, x] = value
+        self.rows[y] ^= 1 << x
+        self.cols[x] ^= 1 << y
+        self.white += 1 if value else -1
+
+        #update the blocks that contain the square
+        self.starts[y] = maskBlocks(self.rows[y], self.k)
+        for y_1 in range(max(0, y - self.k + 1), min(y + 1, len(self.blockrows))):
+            new = self.BlockRow(y_1)
+            self.blocks += new - self.blockrows[y_1]
+            self.blockrows[y_1] = new
+
+        #update the row and column
+        for i, stats, lengths, mask in ((y, self.rowstats, self.rowlengths, self.rows[y]),
+                                        (x, self.colstats, self.collengths, self.cols[x])):
+            for l in lengths[i]:
+                self.counts[l] -= 1
+            lengths[i] = maskLengths(mask)
+            for l in lengths[i]:
+                self.counts[l] = self.counts.get(l, 0) + 1
+
+            new = lineStats(lengths[i], self.spec.min_length)
+            for k in range(4):
+                self.totals[k] += new[k] - stats[i][k]
+            stats[i] = new
+
+        return True
+
+    def Flip(self, y, x):
+        """Flip a square and its symmetric partners, like step. Returns the new loss."""
+        cells = self.spec.Partners(y, x)
+        self.last = ([(y_1, x_1, self.rows[y_1] >> x_1 & 1) for y_1, x_1 in cells],
+                     self.components, self.components.Mark(), self.islands, self.loss)
+
+        value = not self.rows[y] >> x & 1
+        changed = [(y_1, x_1) for y_1, x_1 in cells if self.Set(y_1, x_1, value)]
+
+        if value:
+            #new white squares can only join islands
+            for y_1, x_1 in changed:
+                self.components.Add(self.grid, y_1, x_1)
+        elif changed:
+            #new black squares can split an island, so start over
+            self.components = Components(self.grid)
+
+        self.islands = self.components.count - 1
+        self.loss = self.Loss()
+        return self.loss
+
+    def Undo(self):
+        """Undo the last flip"""
+        cells, components, mark, self.islands, self.loss = self.last
+        for y, x, value in reversed(cells):
+            self.Set(y, x, value)
+
+        if components is self.components:
+            components.Undo(mark)
+        else:
+            self.components = components
+        self.last = None
 
 #%%
 #-------------------------------------------------------------------------------
@@ -197,40 +571,131 @@ def P(old_loss, new_loss, T):
     else:
         return math.exp(-1 * (new_loss - old_loss)/T)
 
-def colour(grid):
-    """Fiddle with a grid until it meets all constraints or 2000 iterations have been reached."""
+def colour(grid, spec=None):
+    """Fiddle with a grid until it meets all constraints or the maximum number of
+    iterations (2000 by default) has been reached."""
+    if spec is None:
+        height, width = grid.shape
+        spec = GridSpec(width, height)
 
-    loss_log = [loss(grid)]
+    #the state is changed in place, and only updates the loss around the flipped squares
+    state = GridState(grid, spec)
+    loss_log = [state.loss]
 
-    #l = loss(grid)
-    max_iterations = 2000
+    max_iterations = spec.iterations
+    height, width = grid.shape
 
     for i in range(max_iterations):
-        #loss_log.append(l)
-
-        T = max_iterations/(i + 1)
-        neighbour = step(grid)
-        l_neighbour = loss(neighbour)
+        T = spec.Temperature(i)
+        x = random.choice(range(width))
+        y = random.choice(range(height))
+        l_neighbour = state.Flip(y, x)
 
         if P(loss_log[-1], l_neighbour, T) >= random.random():
-            grid = neighbour
             loss_log.append(l_neighbour)
-            #l = l_neighbour
+        else:
+            state.Undo()
 
         if loss_log[-1] == 0:
             break
 
-    return grid, loss_log
-
-def generateEmpty(plot = False):
-    """Generate an empty crossword"""
-
-    grid = makeGrid(13)
-    grid, loss_log = colour(grid)
+    return state.grid, loss_log
+
+def chain(args):
+    """Run a chain of annealing steps at a fixed temperature. Returns the final
+    grid, its loss and the grids with zero loss that were visited. Takes a
+    single tuple (grid, T, steps, spec, seed), so it can be used with Pool.map."""
+    grid, T, steps, spec, seed = args
+    #a local generator, so the chain does not reseed the caller's random module
+    rng = random.Random(seed)
+    height, width = grid.shape
+
+    state = GridState(grid, spec)
+    l = state.loss
+    found = [np.copy(state.grid)] if l == 0 else []
+
+    for i in range(steps):
+        x = rng.randrange(width)
+        y = rng.randrange(height)
+        l_neighbour = state.Flip(y, x)
+
+        if P(l, l_neighbour, T) >= rng.random():
+            l = l_neighbour
+            if l == 0:
+                found.append(np.copy(state.grid))
+        else:
+            state.Undo()
+
+    return state.grid, l, found
+
+def tempering(spec=None, chains=4, processes=None, steps=200, temperatures=None, seed=None):
+    """Generate empty crosswords with parallel tempering. Yields every distinct
+    grid with zero loss that is found, for as long as it is asked for more.
+
+    Each chain runs at its own temperature, by default a geometric range from
+    0.2 to 4. In every round, all chains take a number of steps, spread over a
+    pool of processes. Then neighbouring chains swap grids with the usual
+    replica exchange probability, so good grids move to the cold chains and
+    stuck grids can escape through the hot ones."""
+    if spec is None:
+        spec = GridSpec()
+    if temperatures is None:
+        temperatures = [0.2 * 20 ** (k / max(chains - 1, 1)) for k in range(chains)]
+    if processes is None:
+        processes = min(chains, multiprocessing.cpu_count())
+
+    #all randomness comes from the seed, so a seeded run can be repeated
+    rng = random.Random(seed)
+    gridrng = np.random.default_rng(rng.getrandbits(64))
+    grids = [makeGrid(spec.width, spec.height, spec.symmetry, gridrng) for T in temperatures]
+    losses = [loss(grid, spec) for grid in grids]
+    seen = set()
+
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        n = 0
+        while True:
+            tasks = [(grids[k], temperatures[k], steps, spec, rng.getrandbits(32)) for k in range(len(grids))]
+            results = pool.map(chain, tasks) if pool else list(map(chain, tasks))
+
+            for k, (grid, l, found) in enumerate(results):
+                grids[k], losses[k] = grid, l
+                for valid in found:
+                    key = valid.tobytes()
+                    if key not in seen:
+                        seen.add(key)
+                        yield valid
+
+            #replica exchange between neighbouring temperatures, alternating even and odd pairs
+            for k in range(n % 2, len(grids) - 1, 2):
+                delta = (1 / temperatures[k] - 1 / temperatures[k + 1]) * (losses[k] - losses[k + 1])
+                if delta >= 0 or math.exp(delta) >= rng.random():
+                    grids[k], grids[k + 1] = grids[k + 1], grids[k]
+                    losses[k], losses[k + 1] = losses[k + 1], losses[k]
+            n += 1
+    finally:
+        if pool:
+            pool.terminate()
+
+def generateEmpty(plot = False, spec=None, chains=1, processes=None):
+    """Generate an empty crossword. The spec sets the size, symmetry and
+    annealing settings; the default is a 13x13 grid with point symmetry. With
+    more than one chain, the grid is found with parallel tempering."""
+    if spec is None:
+        spec = GridSpec()
+
+    if chains > 1:
+        stream = tempering(spec, chains, processes)
+        grid = next(stream)
+        stream.close()
+        return grid
+
+    grid = makeGrid(spec.width, spec.height, spec.symmetry)
+    grid, loss_log = colour(grid, spec)
 
     #restart search if needed
     while loss_log[-1] != 0:
-        grid, loss_log = colour(grid)
+        grid, loss_log = colour(grid, spec)
 
     if plot:
         plotLoss(loss_log)
@@ -293,7 +758,7 @@ if __name__ == '__main__':
         plt.ylabel('loss')
 
     def plotLengths(grid):
-        lengths = [seqLength(x,y,grid, direction) for direction in ('hor', 'ver') for y,x in startingCors(grid, direction)]
+        lengths = seqLengths(grid)
         labels = np.arange(min(lengths), max(lengths) + 1)
 
         plt.hist(lengths, bins=np.arange(min(lengths), max(lengths) + 2))
@@ -1,6 +1,8 @@
 import xml.etree.ElementTree as ET
 import numpy as np
 
+from vocabindex import tokenise, glyph
+
 class Exporter:
     def Export(path, crossword, clues=None, author='Luka van der Plas'):
         if path.endswith('.xml') or path.endswith('.pzl'):
@@ -20,11 +22,13 @@ class Exporter:
         size_n.text = str(width)+'x'+str(height)
 
         #set up grid
+        #every field is one character, so a digraph like "ij" is written as a ligature
         grid = np.full([width, height], '_', dtype=str)
         for seq in cw.hor+cw.ver:
+            letters = tokenise(list(seq.wordset)[0])
             for i in range(len(seq.cors)):
                 x, y = seq.cors[i]
-                grid[x,y] = list(seq.wordset)[0][i]
+                grid[x,y] = glyph(letters[i])
         grid = grid.T
 
         #add grid node
@@ -0,0 +1,203 @@
+"""
+
+This file contains a library of empty grids, so that grids can be reused for
+many crosswords instead of being generated for every one.
+
+The library is stored in a single .npz file. Each grid is stored bit-packed,
+with its shape, the histogram of its sequence lengths, and the number of fill
+attempts and successes so far. Grids are indexed [y,x], like in emptycrosswords.
+
+Two grids that are the same up to rotation or reflection are the same grid for
+filling in, so the library only keeps one of them. Grids are compared by a
+canonical key: the smallest bit-packed form over all symmetries of the grid.
+
+Run this file to add grids to the library:
+
+    python gridlibrary.py [number of grids] [width] [height]
+"""
+
+import os
+import sys
+import random
+import numpy as np
+
+import emptycrosswords
+
+#-------------------------------------------------------------------------------
+# packing and symmetry
+#-------------------------------------------------------------------------------
+
+def pack(grid):
+    """Bit-pack a boolean grid into bytes."""
+    return np.packbits(np.asarray(grid, dtype=bool)).tobytes()
+
+def unpack(data, shape):
+    """Inverse of pack."""
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=shape[0] * shape[1])
+    return bits.reshape(shape).astype(bool)
+
+def symmetries(grid):
+    """All rotations and reflections of a grid."""
+    for k in range(4):
+        rotated = np.rot90(grid, k)
+        yield rotated
+        yield rotated.T
+
+def canonical(grid):
+    """Key that is the same for all rotations and reflections of a grid."""
+    return min((g.shape, pack(g)) for g in symmetries(grid))
+
+def histogram(grid):
+    """Number of sequences of every length, as a dict."""
+    values, counts = np.unique(emptycrosswords.seqLengths(grid), return_counts=True)
+    return dict(zip(values.tolist(), counts.tolist()))
+
+#-------------------------------------------------------------------------------
+# library class
+#-------------------------------------------------------------------------------
+
+class GridLibrary:
+    def __init__(self, path):
+        """Open the library at path. If the file does not exist yet, the
+        library starts empty and the file is created by Save."""
+        self.path = path
+        self.data = []
+        self.shapes = []
+        self.lengths = []
+        self.attempts = []
+        self.successes = []
+        self.keys = dict()
+
+        if os.path.exists(path):
+            #every access to a member of the .npz file reads it again, so read each once
+            with np.load(path) as stored:
+                grids, sizes, shapes = stored['grids'], stored['sizes'], stored['shapes']
+                lengths, attempts, successes = stored['lengths'], stored['attempts'], stored['successes']
+            for k in range(len(shapes)):
+                row = lengths[k]
+                self.Append(grids[k, :sizes[k]].tobytes(), tuple(int(n) for n in shapes[k]),
+                            {int(l): int(row[l]) for l in np.flatnonzero(row)},
+                            int(attempts[k]), int(successes[k]))
+
+    def __len__(self):
+        return len(self.data)
+
+    def Append(self, data, shape, lengths, attempts=0, successes=0):
+        k = len(self.data)
+        self.data.append(data)
+        self.shapes.append(shape)
+        self.lengths.append(lengths)
+        self.attempts.append(attempts)
+        self.successes.append(successes)
+        self.keys[canonical(unpack(data, shape))] = k
+        return k
+
+    def Add(self, grid):
+        """Add a grid to the library. Returns its number, or None if the grid
+        (or a rotation or reflection of it) is already in the library."""
+        grid = np.asarray(grid, dtype=bool)
+        if canonical(grid) in self.keys:
+            return None
+        return self.Append(pack(grid), grid.shape, histogram(grid))
+
+    def Grid(self, k):
+        """Return grid number k, indexed [y,x]."""
+        return unpack(self.data[k], self.shapes[k])
+
+    def Rate(self, k):
+        """Estimated fill success rate of grid k. Grids that have not been tried
+        yet get a rate of 1/2."""
+        return (self.successes[k] + 1) / (self.attempts[k] + 2)
+
+    def Candidates(self, spec=None):
+        """Numbers of the grids that match the size of a GridSpec, and that
+        have enough words in the spec's vocabulary supply, if it has one."""
+        if spec is None:
+            spec = emptycrosswords.GridSpec()
+        shape = (spec.height, spec.width)
+        candidates = []
+        for k in range(len(self)):
+            if self.shapes[k] != shape:
+                continue
+            if spec.supply is not None:
+                if emptycrosswords.supplyViolations(self.lengths[k], spec.supply, spec.min_supply):
+                    continue
+            candidates.append(k)
+        return candidates
+
+    def Sample(self, spec=None, rng=random):
+        """Pick the number of a grid that matches the spec, weighted by the fill
+        success rate. Returns None if no grid matches."""
+        candidates = self.Candidates(spec)
+        if not candidates:
+            return None
+        weights = [self.Rate(k) for k in candidates]
+        return rng.choices(candidates, weights)[0]
+
+    def Record(self, k, success):
+        """Record the outcome of an attempt to fill in grid k."""
+        self.attempts[k] += 1
+        self.successes[k] += bool(success)
+
+    def Build(self, count, spec=None, chains=1, processes=None, seed=None):
+        """Generate grids with the GridSpec spec until count new grids are added.
+        With more than one chain, the grids come from parallel tempering.
+        Returns the number of grids that were added."""
+        if chains > 1:
+            stream = emptycrosswords.tempering(spec, chains, processes, seed=seed)
+        else:
+            stream = (emptycrosswords.generateEmpty(spec=spec) for i in iter(int, 1))
+
+        added = 0
+        try:
+            for grid in stream:
+                if self.Add(grid) is not None:
+                    added += 1
+                if added >= count:
+                    break
+        finally:
+            stream.close()
+        return added
+
+    def Save(self):
+        """Write the library to its file."""
+        n = len(self)
+        width = max((len(data) for data in self.data), default=0)
+        longest = max((max(lengths, default=0) for lengths in self.lengths), default=0)
+
+        grids = np.zeros((n, width), dtype=np.uint8)
+        lengths = np.zeros((n, longest + 1), dtype=np.int32)
+        for k in range(n):
+            grids[k, :len(self.data[k])] = np.frombuffer(self.data[k], dtype=np.uint8)
+            for l, count in self.lengths[k].items():
+                lengths[k, l] = count
+
+        #write to a temporary file first, so an interrupted save keeps the old library
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as f:
+            np.savez(f,
+                     grids=grids,
+                     sizes=np.array([len(data) for data in self.data], dtype=np.int32),
+                     shapes=np.array(self.shapes, dtype=np.int32).reshape(n, 2),
+                     lengths=lengths,
+                     attempts=np.array(self.attempts, dtype=np.int64),
+                     successes=np.array(self.successes, dtype=np.int64))
+        os.replace(temp, self.path)
+
+#-------------------------------------------------------------------------------
+# batch job
+#-------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 13
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    library = GridLibrary('./grids.npz')
+    spec = emptycrosswords.GridSpec(width, height)
+    chains = min(4, os.cpu_count() or 1)
+
+    print('generating', count, 'grids...')
+    added = library.Build(count, spec, chains=chains)
+    library.Save()
+    print('added', added, 'grids, the library now has', len(library))
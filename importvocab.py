@@ -1,19 +1,354 @@
 import os
 import csv
+import json
+import hashlib
+import unicodedata
+import numpy as np
 
+from vocabindex import LengthIndex, VocabIndex, Alphabet, tokenise, defaultScore
 
+#-------------------------------------------------------------------------------
+# reading the vocabulary
+#-------------------------------------------------------------------------------
 
-def importVocab(path):
-    filenames = os.listdir(path)
+# The vocabulary is a folder of tab separated files, with a lemma and its clues
+# on every row. readVocab streams the rows, so nothing has to be kept in memory
+# that is not needed.
+#
+# Lemmas can be normalised with a list of functions that take a lemma and return
+# the normalised lemma, or None to leave it out. Filters are functions that take
+# a normalised lemma and return whether to keep it.
 
-    vocab = dict()
+def lowercase(lemma):
+    return lemma.lower()
+
+def foldAccents(lemma):
+    'removes accents, so that for instance é and ë become e'
+    decomposed = unicodedata.normalize('NFD', lemma)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def rejectSeparators(lemma):
+    'leaves out lemmas of more than one word, which have spaces or hyphens'
+    if ' ' in lemma or '-' in lemma:
+        return None
+    return lemma
+
+def lengthFilter(min_length=2, max_length=None):
+    'keeps lemmas of min_length up to and including max_length letters, counting ij as one letter'
+    def keep(lemma):
+        l = len(tokenise(lemma))
+        return l >= min_length and (max_length is None or l <= max_length)
+    keep.key = 'length(%s,%s)' % (min_length, max_length)
+    return keep
+
+def scoreFilter(scores, min_score):
+    'keeps lemmas with a score of at least min_score in the dict scores. unscored lemmas get defaultScore(scores)'
+    default = defaultScore(scores)
+    def keep(lemma):
+        return scores.get(lemma, default) >= min_score
+    keep.key = 'score(%s,%s)' % (min_score, scoresHash(scores))
+    return keep
 
-    for filename in filenames:
-        file = open(path + '/' + filename, newline='')
-        table = csv.reader(file, delimiter='\t')
-        for row in table:
+def hookKey(hook):
+    'name of a normalisation or filter function, to tell if a compiled vocabulary used the same ones'
+    return getattr(hook, 'key', hook.__name__)
+
+def readVocab(path, normalise=(), filters=()):
+    """Generate (lemma, clues) for every row of the vocabulary files in path,
+    with the lemma normalised. Rows that are left out by normalise or filters
+    are skipped. A lemma can occur more than once."""
+    for filename in sorted(os.listdir(path)):
+        with open(os.path.join(path, filename), newline='') as file:
+            for row in csv.reader(file, delimiter='\t'):
+                if not row:
+                    continue
+                lemma = row[0]
+                for hook in normalise:
+                    lemma = hook(lemma)
+                    if lemma is None:
+                        break
+                if lemma and all(keep(lemma) for keep in filters):
+                    yield lemma, row[1:]
+
+def mergeClues(vocab, lemma, clues):
+    'adds clues for a lemma to a dict, keeping the clues it already has'
+    known = vocab.setdefault(lemma, [])
+    for clue in clues:
+        if clue not in known:
+            known.append(clue)
+
+def readScores(filepath, normalise=()):
+    """Read word scores from a tab separated file with a lemma and a score on
+    every row. Lemmas are normalised like in readVocab."""
+    scores = dict()
+    with open(filepath, newline='') as file:
+        for row in csv.reader(file, delimiter='\t'):
+            if len(row) < 2:
+                continue
             lemma = row[0]
-            descriptions = row[1:]
-            vocab[lemma] = descriptions
+            for hook in normalise:
+                lemma = hook(lemma)
+                if lemma is None:
+                    break
+            if lemma:
+                scores[lemma] = max(float(row[1]), scores.get(lemma, float('-inf')))
+    return scores
 
+def importVocab(path, normalise=(), filters=()):
+    """Return a dict with the clues of every lemma. Clues of lemmas that occur
+    more than once are merged."""
+    vocab = dict()
+    for lemma, clues in readVocab(path, normalise, filters):
+        mergeClues(vocab, lemma, clues)
     return vocab
+
+#-------------------------------------------------------------------------------
+# compiled vocabulary
+#-------------------------------------------------------------------------------
+
+# Parsing the vocabulary and indexing it takes most of the start up time, so the
+# result is compiled into a single binary file next to the vocabulary folder.
+#
+# The file starts with MAGIC, the length of the header as 8 bytes, and a JSON
+# header. The header holds the version, the source files it was compiled from
+# and the offset, dtype and shape of every array in the rest of the file. The
+# file is memory-mapped, so arrays are only read when they are used.
+#
+# The cache is compiled again if the version changes, if the source files or the
+# score file change, or if different normalisation or filters are used. Files
+# are compared by modification time and size first, and only hashed if those
+# differ. If the hash is the same, the new time and size are written to the
+# header, so the file is not hashed again on the next start. The header is
+# followed by some spare room for this.
+#
+# The clues of all words are stored in one blob of text, with the clues of a word
+# separated by tabs. For every length, an offsets table gives where the clues of
+# the jth word start and end, and a counts table gives how many clues it has, so
+# that no clues and a single empty clue can be told apart. The clues of a word are
+# found without reading any other clues. See Vocab.Clues.
+
+MAGIC = b'CWVOCAB\0'
+VERSION = 7
+
+#arrays start at multiples of this many bytes
+ALIGN = 64
+
+#spare bytes after the header, so it can be rewritten in place
+SLACK = 256
+
+def fileStat(filepath):
+    """Modification time and size of a file."""
+    stat = os.stat(filepath)
+    return {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+def sources(path):
+    """Modification time and size of the vocabulary files, by file name."""
+    return {filename: fileStat(os.path.join(path, filename)) for filename in sorted(os.listdir(path))}
+
+def fileHash(filepath):
+    with open(filepath, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+def readHeader(cachepath):
+    """Return the header of a compiled vocabulary and the offset of its data,
+    or None if the file is missing or not a compiled vocabulary."""
+    if not os.path.exists(cachepath):
+        return None
+    with open(cachepath, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            return None
+        size = int.from_bytes(file.read(8), 'little')
+        header = json.loads(file.read(size).decode('utf-8'))
+    start = len(MAGIC) + 8 + size
+    return header, start + (-start) % ALIGN
+
+def writeHeader(cachepath, header):
+    """Rewrite the header of a compiled vocabulary in place. Returns False if
+    the new header does not fit in the room of the old one."""
+    with open(cachepath, 'r+b') as file:
+        file.seek(len(MAGIC))
+        size = int.from_bytes(file.read(8), 'little')
+        encoded = json.dumps(header).encode('utf-8')
+        if len(encoded) > size:
+            return False
+        #trailing spaces are allowed in JSON
+        file.write(encoded + b' ' * (size - len(encoded)))
+    return True
+
+def scoresHash(scores):
+    if scores is None:
+        return None
+    return hashlib.sha1(json.dumps(scores, sort_keys=True).encode('utf-8')).hexdigest()
+
+def upToDate(path, cachepath, header, hooks, scores=None, scorepath=None):
+    """Whether a compiled vocabulary still matches the files, the
+    normalisation and filters and the scores or score file it was made with.
+    Files that were touched but not changed get their new time and size in the
+    header."""
+    if header.get('version') != VERSION or header.get('hooks') != hooks:
+        return False
+    if header.get('scores') != scoresHash(scores):
+        return False
+    if (scorepath is None) != (header.get('scorefile') is None):
+        return False
+    current = sources(path)
+    compiled = header['sources']
+    if set(current) != set(compiled):
+        return False
+
+    #(path, time and size now, time, size and hash in the header) of every file
+    tracked = [(os.path.join(path, filename), stat, compiled[filename]) for filename, stat in current.items()]
+    if scorepath is not None:
+        tracked.append((scorepath, fileStat(scorepath), header['scorefile']))
+    touched = False
+    for filepath, stat, recorded in tracked:
+        if stat['mtime'] != recorded['mtime'] or stat['size'] != recorded['size']:
+            if fileHash(filepath) != recorded['hash']:
+                return False
+            recorded.update(stat)
+            touched = True
+    if touched:
+        writeHeader(cachepath, header)
+    return True
+
+def compileVocab(path, cachepath, normalise=(), filters=(), scores=None, scorepath=None):
+    """Parse the vocabulary at path, index it and write it to cachepath. See
+    LengthIndex for scores. Instead of a dict of scores, a score file can be
+    given as scorepath, which is read with readScores."""
+    found = sources(path)
+    for filename in found:
+        found[filename]['hash'] = fileHash(os.path.join(path, filename))
+
+    scorefile = None
+    scoretable = scores
+    if scorepath is not None:
+        scorefile = fileStat(scorepath)
+        scorefile['hash'] = fileHash(scorepath)
+        scoretable = readScores(scorepath, normalise)
+
+    vocabwithclues = importVocab(path, normalise, filters)
+
+    #organise the vocab by number of letters
+    vocabdict = dict()
+    for lemma in vocabwithclues:
+        vocabdict.setdefault(len(tokenise(lemma)), set()).add(lemma)
+
+    #letters are numbered the same way for all lengths
+    alphabet = Alphabet()
+    arrays = dict()
+    blob = []
+    size = 0
+    for l, words in vocabdict.items():
+        index = LengthIndex(words, l, alphabet, scoretable)
+        words, codes, packed, wordscores = index.Arrays()
+        arrays['words/%d' % l] = words
+        arrays['codes/%d' % l] = codes
+        arrays['masks/%d' % l] = packed
+        arrays['scores/%d' % l] = wordscores
+
+        #clues of the jth word are at offsets[j] up to offsets[j+1] in the blob
+        offsets = np.zeros(index.n + 1, dtype=np.int64)
+        counts = np.zeros(index.n, dtype=np.int32)
+        offsets[0] = size
+        for j, word in enumerate(index.words):
+            encoded = '\t'.join(vocabwithclues[word]).encode('utf-8')
+            blob.append(encoded)
+            size += len(encoded)
+            offsets[j + 1] = size
+            counts[j] = len(vocabwithclues[word])
+        arrays['clueoffsets/%d' % l] = offsets
+        arrays['cluecounts/%d' % l] = counts
+    arrays['clues'] = np.frombuffer(b''.join(blob), dtype=np.uint8)
+    arrays['alphabet'] = np.array(alphabet.tokens, dtype='<U2')
+
+    #lay out the arrays after the header
+    sections = dict()
+    offset = 0
+    for name, array in arrays.items():
+        sections[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset += array.nbytes + (-array.nbytes) % ALIGN
+    header = {'version': VERSION,
+              'sources': found,
+              'hooks': [hookKey(hook) for hook in list(normalise) + list(filters)],
+              'scores': scoresHash(scores),
+              'scorefile': scorefile,
+              'sizes': {l: len(words) for l, words in vocabdict.items()},
+              'sections': sections}
+    encoded = json.dumps(header).encode('utf-8') + b' ' * SLACK
+
+    #write to a temporary file first, so an interrupted compile keeps the old cache
+    temp = cachepath + '.tmp'
+    with open(temp, 'wb') as file:
+        file.write(MAGIC)
+        file.write(len(encoded).to_bytes(8, 'little'))
+        file.write(encoded)
+        file.write(bytes(-file.tell() % ALIGN))
+        for name, array in arrays.items():
+            data = np.ascontiguousarray(array).tobytes()
+            file.write(data)
+            file.write(bytes(-len(data) % ALIGN))
+    os.replace(temp, cachepath)
+
+class Vocab:
+    def __init__(self, cachepath):
+        """Open a compiled vocabulary. The index of each length is only built
+        when that length is used, and clues are only read when asked for."""
+        header, start = readHeader(cachepath)
+        self.data = np.memmap(cachepath, dtype=np.uint8, mode='r')
+        self.sections = header['sections']
+        self.start = start
+
+        #number of words of every length
+        self.supply = {int(l): n for l, n in header['sizes'].items()}
+
+        self.alphabet = Alphabet(self.Array('alphabet').tolist())
+        self.index = VocabIndex(alphabet=self.alphabet)
+        for l in self.supply:
+            self.index.Defer(l, self.Builder(l))
+
+    def Array(self, name):
+        """A memory-mapped view of an array in the file."""
+        section = self.sections[name]
+        dtype = np.dtype(section['dtype'])
+        count = int(np.prod(section['shape'], dtype=np.int64))
+        begin = self.start + section['offset']
+        view = self.data[begin : begin + count * dtype.itemsize].view(dtype)
+        return view.reshape(section['shape'])
+
+    def Builder(self, l):
+        def build():
+            return LengthIndex.FromArrays(self.Array('words/%d' % l), self.Array('codes/%d' % l),
+                                          self.Array('masks/%d' % l), self.Array('scores/%d' % l),
+                                          self.alphabet)
+        return build
+
+    def Clues(self, words):
+        """Return a dict with the clues of the given words. Clues of lemmas that
+        occurred more than once in the vocabulary are merged."""
+        blob = self.Array('clues')
+        clues = dict()
+        for word in words:
+            l = len(tokenise(word))
+            j = self.index.Length(l).id[word]
+            offsets = self.Array('clueoffsets/%d' % l)
+            if self.Array('cluecounts/%d' % l)[j] == 0:
+                clues[word] = []
+            else:
+                clues[word] = blob[offsets[j] : offsets[j + 1]].tobytes().decode('utf-8').split('\t')
+        return clues
+
+def loadVocab(path, cachepath=None, normalise=(), filters=(), scores=None, scorepath=None):
+    """Load the vocabulary at path from its compiled form, compiling it first if
+    needed. By default, the compiled vocabulary is stored next to the folder as
+    path + '.bin'. See readVocab for normalise and filters, and LengthIndex for
+    scores. A score file given as scorepath is only read when the vocabulary is
+    compiled, and is tracked like the vocabulary files."""
+    if scores is not None and scorepath is not None:
+        raise ValueError('give either scores or scorepath, not both')
+    if cachepath is None:
+        cachepath = path.rstrip('/\\') + '.bin'
+    hooks = [hookKey(hook) for hook in list(normalise) + list(filters)]
+    found = readHeader(cachepath)
+    if found is None or not upToDate(path, cachepath, found[0], hooks, scores, scorepath):
+        compileVocab(path, cachepath, normalise, filters, scores, scorepath)
+    return Vocab(cachepath)
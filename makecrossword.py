@@ -3,92 +3,141 @@
 print('importing modules...')
 
 import random
+import os
 
-from importvocab import importVocab
+from importvocab import loadVocab, lowercase, foldAccents, rejectSeparators
 import emptycrosswords
 import crosswordFiller as cf
+import portfolio
+import gridlibrary
 from exporter import Exporter
 
-#%%
+#the script only runs as the main module. worker processes that are not forked
+#import this file again, and should not load the vocabulary or start a search
+if __name__ == '__main__':
+    #%%
 
-#-------------------------------------------------------------------------------
-# vocab import
-#-------------------------------------------------------------------------------
+    #-------------------------------------------------------------------------------
+    # vocab import
+    #-------------------------------------------------------------------------------
 
-print('importing vocab...')
+    print('importing vocab...')
 
-#import vocab
-vocabpath = './vocab'
-vocabwithclues = importVocab(vocabpath)
-vocablist = list(vocabwithclues.keys())    #we don't care about the clues for now
+    #import vocab, compiled to ./vocab.bin on the first run and whenever the files change
+    #words are lowercased without accents, and lemmas of more than one word are left out
+    vocabpath = './vocab'
+    normalise = [lowercase, foldAccents, rejectSeparators]
 
-#organise the vocab by length
-#vocab dict contains a set of words for every length w
-vocabdict = dict()
-for w in vocablist:
-    l = len(w)
-    if l in vocabdict.keys():
-        vocabdict[l].add(w)
-    else:
-        vocabdict[l] = {w}
+    #optional scores for the words, with a lemma and a score on every row. better words are tried more often
+    #the file is only read when the vocab is compiled again
+    scorepath = './scores.tsv'
+    if not os.path.exists(scorepath):
+        scorepath = None
 
-#%%
+    vocab = loadVocab(vocabpath, normalise=normalise, scorepath=scorepath)
 
-#-------------------------------------------------------------------------------
-# generate crossword
-#-------------------------------------------------------------------------------
+    #index of the words by position and letter, shared by all fill attempts.
+    #the index of a length is only built when a sequence of that length needs it
+    vocabindex = vocab.index
 
-def generate():
-    print('generating empty grid...')
-    emptygrid = emptycrosswords.generateEmpty()
+    #%%
 
-    print('filling in crossword...')
-    c =  cf.Crossword(emptygrid, vocabdict)
-    solved = cf.FillIn(c.hor+c.ver, c)
+    #-------------------------------------------------------------------------------
+    # generate crossword
+    #-------------------------------------------------------------------------------
 
-    return solved
+    #number of fill attempts that run in parallel
+    processes = os.cpu_count() or 1
 
-solved = generate()
+    #size, symmetry and annealing settings for the empty grid
+    #the number of words of each length steers the grid away from lengths the vocab can't fill
+    supply = vocab.supply
+    gridspec = emptycrosswords.GridSpec(13, supply=supply)
+
+    #library of empty grids, built with gridlibrary.py. without it, a new grid is made for every attempt
+    librarypath = './grids.npz'
+    library = gridlibrary.GridLibrary(librarypath) if os.path.exists(librarypath) else None
+
+    def generate():
+        k = library.Sample(gridspec) if library else None
+
+        if k is not None:
+            print('taking empty grid', k, 'from the library...')
+            emptygrid = library.Grid(k)
+        elif processes > 1:
+            print('generating and filling in', processes, 'crosswords in parallel...')
+            return portfolio.FillPortfolio(vocabindex, processes=processes, timeout=60, spec=gridspec)
+        else:
+            print('generating empty grid...')
+            emptygrid = emptycrosswords.generateEmpty(spec=gridspec)
+
+        #empty grids are indexed [y,x], crosswords [x,y]
+        if not emptycrosswords.fillable(emptygrid, gridspec) or not cf.feasible(emptygrid.T, vocabindex):
+            print('grid cannot be filled in, skipping...')
+            solved = None
+
+        elif processes > 1:
+            print('filling in', processes, 'times in parallel...')
+            solved = portfolio.FillPortfolio(vocabindex, processes=processes, grid=emptygrid.T, timeout=60)
+
+        else:
+            print('filling in crossword...')
+            c =  cf.Crossword(emptygrid.T, vocabindex)
+            #give up on a grid after a minute, restarting the search with a Luby schedule until then
+            solved = cf.FillIn(c.hor+c.ver, c, order='weighted', backjump=True, restarts='luby', timeout=60)
+
+        #keep track of which grids are easy to fill in, so they are picked more often
+        if k is not None:
+            library.Record(k, solved is not None)
+            library.Save()
+
+        return solved
 
-while not solved:
     solved = generate()
 
-#%%
+    while not solved:
+        solved = generate()
+
+    #%%
+
+    #-------------------------------------------------------------------------------
+    # match it with clues
+    #-------------------------------------------------------------------------------
 
-#-------------------------------------------------------------------------------
-# match it with clues
-#-------------------------------------------------------------------------------
+    print('finding clues...')
 
-print('finding clues...')
+    #only the clues of the words in the crossword are read
+    clues = vocab.Clues(seq.Word() for seq in solved.sequences)
 
-def cluelist(sequencelist):
-    """Returns a list of clues, in the order matching the original list."""
-    words = [list(seq.wordset)[0] for seq in sequencelist]
-    return [random.choice(vocabwithclues[word]) for word in words]
+    def cluelist(sequencelist):
+        """Returns a list of clues, in the order matching the original list. Words
+        without a clue get an empty clue."""
+        words = [list(seq.wordset)[0] for seq in sequencelist]
+        return [random.choice(clues[word]) if clues[word] else '' for word in words]
 
-def sortedverticals(cw):
-    """Returns a list of all vertical sequences, but sorted by row instead of by
-    column."""
-    words = []
-    for y in range(cw.Height):
-        for x in range(cw.Width):
-            seq = cw.Seq(x,y,'ver')
-            if seq:
-                starting_x, starting_y = seq.cors[0]
-                if starting_y == y:
-                    words.append(seq)
-    return words
+    def sortedverticals(cw):
+        """Returns a list of all vertical sequences, but sorted by row instead of by
+        column."""
+        words = []
+        for y in range(cw.Height):
+            for x in range(cw.Width):
+                seq = cw.Seq(x,y,'ver')
+                if seq:
+                    starting_x, starting_y = seq.cors[0]
+                    if starting_y == y:
+                        words.append(seq)
+        return words
 
-hor_clues = cluelist(solved.hor)
-sorted_ver = sortedverticals(solved)
-ver_clues = cluelist(sorted_ver)
+    hor_clues = cluelist(solved.hor)
+    sorted_ver = sortedverticals(solved)
+    ver_clues = cluelist(sorted_ver)
 
-#%%
+    #%%
 
-#-------------------------------------------------------------------------------
-# export
-#-------------------------------------------------------------------------------
+    #-------------------------------------------------------------------------------
+    # export
+    #-------------------------------------------------------------------------------
 
-print('exporting...')
+    print('exporting...')
 
-Exporter.Export('test.xml', solved,  (hor_clues, ver_clues), author='Luka')
+    Exporter.Export('test.xml', solved,  (hor_clues, ver_clues), author='Luka')
@@ -0,0 +1,111 @@
+"""
+
+This file runs a portfolio of fill attempts in parallel.
+
+Every attempt runs in its own process, with its own seed and its own mix of
+search heuristics, and (unless a grid is given) its own empty grid from
+emptycrosswords. The first attempt that fills in its crossword wins, and the
+other processes are stopped.
+
+The vocabulary index is stored in a module variable before the pool is started.
+Where possible, the worker processes are forked, so they inherit the index
+from the parent instead of receiving a pickled copy of it.
+"""
+
+import multiprocessing
+import os
+import random
+import numpy as np
+
+import emptycrosswords
+import crosswordFiller as cf
+
+#vocabulary index used by the workers, set by FillPortfolio
+vocabindex = None
+
+#heuristic mixes, assigned to the attempts in turn
+HEURISTICS = [
+    {'order': 'weighted', 'backjump': True, 'restarts': 'luby', 'tiebreak': None},
+    {'order': 'lcv', 'backjump': True, 'restarts': 'luby', 'tiebreak': 'degree'},
+    {'order': 'random', 'backjump': False, 'restarts': 'geometric', 'tiebreak': 'entropy'},
+    {'order': 'lcv', 'backjump': True, 'restarts': 'geometric', 'tiebreak': None},
+]
+
+def setIndex(index):
+    """Initialiser for workers that are not forked. The index is pickled and
+    sent to every one of these workers, so they do not share it."""
+    global vocabindex
+    vocabindex = index
+
+def attempt(settings):
+    """Run a single fill attempt. Returns the grid and the words of the
+    sequences, or None if the attempt failed."""
+    seed = settings['seed']
+    heuristics = dict(settings['heuristics'])
+    tiebreak = heuristics.pop('tiebreak')
+
+    #forked workers start with the same random state, so reseed everything
+    random.seed(seed)
+    np.random.seed(seed % 2**32)
+
+    grid = settings['grid']
+    if grid is None:
+        #empty grids are indexed [y,x], crosswords [x,y]
+        grid = emptycrosswords.generateEmpty(spec=settings['spec']).T
+
+    #grids that fail the quick checks are rejected before any search is done
+    if not emptycrosswords.fillable(grid.T, settings['spec']) or not cf.feasible(grid, vocabindex):
+        return None
+
+    c = cf.Crossword(grid, vocabindex, tiebreak=tiebreak)
+    solved = cf.FillIn(c.sequences, c, timeout=settings['timeout'], seed=seed, **heuristics)
+
+    if solved:
+        return grid, [seq.Word() for seq in solved.sequences]
+    return None
+
+def FillPortfolio(index, attempts=None, processes=None, grid=None, timeout=60, seed=None, spec=None):
+    """Run fill attempts in a process pool and return the first filled in
+    crossword, or None if all attempts failed. By default, there is one attempt
+    per CPU core. Each attempt gives up after timeout seconds. Without a grid,
+    every attempt generates its own empty grid with the GridSpec spec."""
+    global vocabindex
+    vocabindex = index
+    #build deferred lengths once here, instead of once in every worker
+    index.Load()
+
+    if processes is None:
+        processes = os.cpu_count()
+    if attempts is None:
+        attempts = processes
+
+    rng = random.Random(seed)
+    settings = [{'seed': rng.getrandbits(63),
+                 'heuristics': HEURISTICS[i % len(HEURISTICS)],
+                 'grid': grid,
+                 'spec': spec,
+                 'timeout': timeout}
+                for i in range(attempts)]
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        pool = multiprocessing.get_context('fork').Pool(processes)
+    else:
+        pool = multiprocessing.Pool(processes, initializer=setIndex, initargs=(index,))
+
+    result = None
+    try:
+        for output in pool.imap_unordered(attempt, settings):
+            if output:
+                result = output
+                break
+    finally:
+        #stop the attempts that are still running
+        pool.terminate()
+        pool.join()
+
+    if result:
+        solvedgrid, words = result
+        c = cf.Crossword(solvedgrid, index)
+        c.FillWords(words)
+        return c
+    return None
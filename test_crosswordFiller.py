@@ -0,0 +1,88 @@
+"""
+
+Randomised checks for the crosswordFiller. Run with pytest.
+"""
+
+import random
+import numpy as np
+
+import crosswordFiller as cf
+from vocabindex import VocabIndex, tokenise
+
+def randomInstance(trial, sizes=(4, 5, 6), letters='abcd', words=(5, 60)):
+    """A small grid with a few black fields and a small random vocabulary, so
+    that some instances can be filled in and some cannot."""
+    rng = random.Random(trial)
+    n = rng.choice(sizes)
+    grid = np.ones((n, n), bool)
+    for i in range(rng.randint(0, 4)):
+        grid[rng.randrange(n), rng.randrange(n)] = False
+    vocab = {l: {''.join(rng.choice(letters) for i in range(l)) for k in range(rng.randint(*words))}
+             for l in range(2, max(sizes) + 1)}
+    return grid, vocab
+
+def checkSolution(cw, vocab):
+    """Every sequence has a word from the vocabulary, and crossing words agree."""
+    for seq in cw.sequences:
+        word = seq.Word()
+        assert word is not None and word in vocab[len(seq)]
+    for seq in cw.hor:
+        for i, (x, y) in enumerate(seq.cors):
+            other, j = cw.Crossing(seq, i)
+            if other:
+                assert tokenise(seq.Word())[i] == tokenise(other.Word())[j]
+
+def test_backjump_agrees_with_chronological():
+    for trial in range(100):
+        grid, vocab = randomInstance(trial)
+        index = VocabIndex(vocab)
+        status = dict()
+        for backjump in [False, True]:
+            search = cf.Search(cf.Crossword(grid, index), seed=trial, backjump=backjump)
+            solved = search.Run(max_nodes=20000)
+            assert search.status in ('solved', 'failed')
+            if solved:
+                checkSolution(solved, vocab)
+            status[backjump] = search.status
+        assert status[False] == status[True], trial
+
+def test_undo_restores_crossword():
+    grid, vocab = randomInstance(3)
+    cw = cf.Crossword(grid, VocabIndex(vocab))
+    before = [(seq.mask, seq.culprits, seq.letteroptions) for seq in cw.sequences]
+    mark = cw.Mark()
+    search = cf.Search(cw, seed=0, backjump=True)
+    search.Run(max_nodes=50)
+    cw.Undo(mark)
+    assert [(seq.mask, seq.culprits, seq.letteroptions) for seq in cw.sequences] == before
+
+def test_resume_keeps_tiebreak():
+    for trial in range(20):
+        grid, vocab = randomInstance(trial, sizes=(5, 6, 7), letters='abcde', words=(50, 300))
+        index = VocabIndex(vocab)
+        whole = cf.Search(cf.Crossword(grid, index, tiebreak='degree'), seed=trial, backjump=True)
+        whole.Run(max_nodes=2000)
+
+        paused = cf.Search(cf.Crossword(grid, index, tiebreak='degree'), seed=trial, backjump=True)
+        paused.Run(max_nodes=3)
+        state = paused.State()
+        resumed = cf.Search.Resume(state, cf.Crossword(np.array(state['grid'], bool), index, tiebreak=state['tiebreak']))
+        resumed.Run(max_nodes=2000 - paused.nodes)
+        assert (resumed.status, resumed.nodes) == (whole.status, whole.nodes), trial
+        assert [seq.Word() for seq in resumed.cw.sequences] == [seq.Word() for seq in whole.cw.sequences], trial
+
+    #a crossword with another tiebreak is rejected
+    try:
+        cf.Search.Resume(state, cf.Crossword(np.array(state['grid'], bool), index))
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_fillin_budget_resets_crossword():
+    for trial in range(20):
+        grid, vocab = randomInstance(trial, sizes=(5, 6, 7), letters='abcde', words=(50, 300))
+        cw = cf.Crossword(grid, VocabIndex(vocab))
+        before = [(seq.mask, seq.culprits, seq.letteroptions) for seq in cw.sequences]
+        if cf.FillIn(cw.sequences, cw, backjump=True, max_backtracks=1, seed=trial) is None:
+            assert [(seq.mask, seq.culprits, seq.letteroptions) for seq in cw.sequences] == before, trial
@@ -0,0 +1,77 @@
+"""
+
+Randomised checks for emptycrosswords. Run with pytest.
+"""
+
+import numpy as np
+
+import emptycrosswords as ec
+
+def randomGrids(count, seed=0):
+    rng = np.random.default_rng(seed)
+    for k in range(count):
+        n = int(rng.integers(3, 14))
+        yield rng.random((n, n)) < rng.uniform(0.3, 0.9)
+
+def test_seqLengths_matches_cellwise():
+    for grid in randomGrids(500):
+        #the sequence lengths found square by square
+        expected = []
+        for direction in ['hor', 'ver']:
+            for y, x in ec.startingCors(grid, direction):
+                expected.append(ec.seqLength(x, y, grid, direction))
+        assert sorted(ec.seqLengths(grid).tolist()) == sorted(expected)
+
+def test_gridstate_matches_loss():
+    rng = np.random.default_rng(1)
+    supply = {l: int(rng.integers(0, 200)) for l in range(2, 14)}
+    for k, grid in enumerate(randomGrids(60, seed=1)):
+        n = grid.shape[0]
+        spec = ec.GridSpec(n, supply=supply if k % 2 else None)
+        state = ec.GridState(grid, spec)
+        assert state.loss == ec.loss(state.grid, spec)
+        for i in range(40):
+            l = state.Flip(int(rng.integers(n)), int(rng.integers(n)))
+            assert l == ec.loss(state.grid, spec)
+            if rng.random() < 0.5:
+                state.Undo()
+                assert state.loss == ec.loss(state.grid, spec)
+        #the updated statistics are the same as those of a new state
+        fresh = ec.GridState(state.grid, spec)
+        assert fresh.totals == state.totals and fresh.white == state.white
+        assert fresh.blocks == state.blocks and fresh.rows == state.rows and fresh.cols == state.cols
+
+def floodIslands(grid):
+    """Number of islands of white squares minus one, found with a flood fill."""
+    height, width = grid.shape
+    seen = np.zeros(grid.shape, bool)
+    count = 0
+    for y in range(height):
+        for x in range(width):
+            if grid[y, x] and not seen[y, x]:
+                count += 1
+                stack = [(y, x)]
+                seen[y, x] = True
+                while stack:
+                    y_1, x_1 = stack.pop()
+                    for y_2, x_2 in [(y_1 + 1, x_1), (y_1 - 1, x_1), (y_1, x_1 + 1), (y_1, x_1 - 1)]:
+                        if 0 <= y_2 < height and 0 <= x_2 < width and grid[y_2, x_2] and not seen[y_2, x_2]:
+                            seen[y_2, x_2] = True
+                            stack.append((y_2, x_2))
+    return count - 1
+
+def test_islands_matches_flood_fill():
+    for grid in randomGrids(300, seed=2):
+        assert ec.islands(grid) == floodIslands(grid)
+
+    #the union-find kept by GridState, through flips that add and remove squares and their undos
+    rng = np.random.default_rng(3)
+    for grid in randomGrids(40, seed=3):
+        n = grid.shape[0]
+        state = ec.GridState(grid)
+        for i in range(40):
+            state.Flip(int(rng.integers(n)), int(rng.integers(n)))
+            assert state.islands == floodIslands(state.grid)
+            if rng.random() < 0.5:
+                state.Undo()
+                assert state.islands == floodIslands(state.grid)
@@ -0,0 +1,53 @@
+"""
+
+Checks for the compiled vocabulary of importvocab. Run with pytest.
+"""
+
+import os
+
+import importvocab
+from importvocab import loadVocab, lowercase, lengthFilter, readHeader
+
+def writeVocab(tmp_path, rows):
+    """Write a vocabulary folder with a single file of tab separated rows."""
+    path = tmp_path / 'vocab'
+    path.mkdir()
+    with open(path / 'words.tsv', 'w') as file:
+        for row in rows:
+            file.write('\t'.join(row) + '\n')
+    return str(path)
+
+def test_clues_round_trip(tmp_path):
+    path = writeVocab(tmp_path, [['kat', 'dier', 'huisdier'], ['hond'], ['muis', ''], ['kat', 'poes']])
+    loadVocab(path)
+    #open the compiled file again, so the clues are read from it
+    clues = loadVocab(path).Clues(['kat', 'hond', 'muis'])
+    assert clues == {'kat': ['dier', 'huisdier', 'poes'], 'hond': [], 'muis': ['']}
+
+def test_length_filter_counts_letters(tmp_path):
+    path = writeVocab(tmp_path, [['Lijn'], ['kat'], ['hond'], ['ijs']])
+    vocab = loadVocab(path, normalise=[lowercase], filters=[lengthFilter(max_length=3)])
+    #ij is a single letter, so lijn has three letters and ijs has two
+    assert vocab.supply == {2: 1, 3: 2}
+    assert sorted(vocab.index.Length(3).words) == ['kat', 'lijn']
+
+def test_touched_file_is_not_compiled_again(tmp_path, monkeypatch):
+    path = writeVocab(tmp_path, [['kat', 'dier']])
+    loadVocab(path)
+    filepath = os.path.join(path, 'words.tsv')
+    stat = os.stat(filepath)
+    os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    #a touched file gets its new time in the header, without compiling
+    def compileVocab(*args):
+        raise AssertionError('compiled again')
+    monkeypatch.setattr(importvocab, 'compileVocab', compileVocab)
+    loadVocab(path)
+    header, start = readHeader(path + '.bin')
+    assert header['sources']['words.tsv']['mtime'] == stat.st_mtime_ns + 10**9
+    monkeypatch.undo()
+
+    #a changed file is compiled again
+    with open(filepath, 'a') as file:
+        file.write('hond\tdier\n')
+    assert loadVocab(path).supply == {3: 1, 4: 1}
@@ -0,0 +1,264 @@
+"""
+
+This file contains the vocabulary index used by the crosswordFiller.
+
+Words are split into letters first. A letter is usually a single character,
+but Dutch crosswords count "IJ" as a single letter, so it is one token (see
+tokenise). The length of a word is its number of letters. Letters are numbered
+by an Alphabet that is shared by all lengths, so letters can be compared as
+integers between sequences of different lengths.
+
+The words of each length are stored in a fixed order, so that any set of words
+of that length can be represented as a bitset: a python int in which bit j is
+set if the j-th word is in the set. For each position and letter, the index
+holds the bitset of all words that have that letter at that position.
+
+Removing all words with a given letter at a position is then a single bitwise
+AND, and a letter is still an option at a position if the AND of its mask with
+the current wordset is not zero.
+
+Words can have a score, a positive number where higher is better. The words of
+a length are then sorted from the best to the worst score, so the lowest set
+bit of a wordset is always its best word.
+
+An index can also be stored as arrays (see LengthIndex.Arrays), which is how
+importvocab caches it. A VocabIndex can defer building the index of a length
+until that length is used.
+"""
+
+import numpy as np
+
+#-------------------------------------------------------------------------------
+# letters
+#-------------------------------------------------------------------------------
+
+#letters that are written with two characters, and the single character for them
+DIGRAPHS = {'ij': '\u0133', 'IJ': '\u0132', 'Ij': '\u0132'}
+
+#single characters that are the same letter as a digraph
+LIGATURES = {'\u0133': 'ij', '\u0132': 'IJ'}
+
+def tokenise(word):
+    """Split a word into its letters."""
+    tokens = []
+    i = 0
+    while i < len(word):
+        if word[i:i+2] in DIGRAPHS:
+            tokens.append(word[i:i+2])
+            i += 2
+        else:
+            tokens.append(LIGATURES.get(word[i], word[i]))
+            i += 1
+    return tokens
+
+def glyph(token):
+    """The letter as a single character, for places that have room for only one."""
+    return DIGRAPHS.get(token, token)
+
+class Alphabet:
+    def __init__(self, tokens=()):
+        """Numbering of letters. Numbers fit in a uint8, in order of first use."""
+        self.tokens = []
+        self.ids = dict()
+        for token in tokens:
+            self.Id(token)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def Id(self, token):
+        """Return the number of a letter, adding it if it is new."""
+        if token not in self.ids:
+            if len(self.tokens) == 256:
+                raise ValueError('an alphabet can have at most 256 letters')
+            self.ids[token] = len(self.tokens)
+            self.tokens.append(token)
+        return self.ids[token]
+
+    def Encode(self, word):
+        """Return the letters of a word as an array of numbers."""
+        return np.array([self.Id(token) for token in tokenise(word)], dtype=np.uint8)
+
+    def Decode(self, codes):
+        """Inverse of Encode."""
+        return ''.join(self.tokens[c] for c in codes)
+
+def defaultScore(scores):
+    """Score of words that are not in a dict of scores: the lowest given score,
+    so that unscored words never rank above scored ones."""
+    if not scores:
+        return 1.0
+    return min(scores.values())
+
+#-------------------------------------------------------------------------------
+# bitset helpers
+#-------------------------------------------------------------------------------
+
+def fromBools(array):
+    """Convert a boolean array to a bitset. Bit j is set if array[j] is True."""
+    packed = np.packbits(np.asarray(array, dtype=bool), bitorder='little')
+    return int.from_bytes(packed.tobytes(), 'little')
+
+def ids(mask, n):
+    """Return the indices of the set bits in a bitset of n bits as an array."""
+    if not mask:
+        return np.zeros(0, dtype=np.int64)
+    nbytes = (n + 7) // 8
+    packed = np.frombuffer(mask.to_bytes(nbytes, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(packed, bitorder='little'))
+
+def popcount(mask):
+    """Number of set bits in a bitset."""
+    return mask.bit_count()
+
+def nthBit(mask, k):
+    """Return the index of the kth set bit (counting from 0) of a bitset,
+    without decoding the other bits. The bitset is halved until it fits in
+    a machine word, so this takes time linear in the size of the bitset."""
+    offset = 0
+    while mask.bit_length() > 64:
+        half = mask.bit_length() // 2
+        low = mask & ((1 << half) - 1)
+        below = popcount(low)
+        if k < below:
+            mask = low
+        else:
+            k -= below
+            mask >>= half
+            offset += half
+    for i in range(k):
+        mask &= mask - 1
+    return offset + (mask & -mask).bit_length() - 1
+
+#-------------------------------------------------------------------------------
+# index classes
+#-------------------------------------------------------------------------------
+
+class LengthIndex:
+    def __init__(self, words, l, alphabet=None, scores=None):
+        """Index all words of l letters. Letters are numbered by the alphabet.
+        scores is a dict with the score of each word; words that are not in it
+        get defaultScore(scores). Without scores, words are sorted alphabetically."""
+        self.l = l
+        self.alphabet = alphabet if alphabet is not None else Alphabet()
+        default = defaultScore(scores)
+        if scores is None:
+            self.words = sorted(words)
+        else:
+            self.words = sorted(words, key=lambda w: (-scores.get(w, default), w))
+        self.n = len(self.words)
+        self.scores = np.array([scores.get(w, default) for w in self.words] if scores else [default] * self.n, dtype=np.float64)
+        self.full = (1 << self.n) - 1
+        self.id = {w: j for j, w in enumerate(self.words)}
+
+        #masks[i][letter] is the bitset of words with that letter number at position i
+        self.masks = [dict() for i in range(l)]
+        #codes[j, i] is the number of the ith letter of word j
+        self.codes = np.zeros((self.n, l), dtype=np.uint8)
+        if self.n > 0:
+            self.codes = np.array([self.alphabet.Encode(w) for w in self.words], dtype=np.uint8)
+            for i in range(l):
+                column = self.codes[:, i]
+                for letter in np.unique(column):
+                    self.masks[i][int(letter)] = fromBools(column == letter)
+
+    def __len__(self):
+        return self.n
+
+    def __deepcopy__(self, memo):
+        #the index is never changed after construction, so copies can share it
+        return self
+
+    def Arrays(self):
+        """Return the index as arrays: the words, the letter codes, the masks,
+        bit-packed into an array of shape (l, letters, bytes), and the scores."""
+        nbytes = (self.n + 7) // 8
+        packed = np.zeros((self.l, len(self.alphabet), nbytes), dtype=np.uint8)
+        for i in range(self.l):
+            for letter, mask in self.masks[i].items():
+                packed[i, letter] = np.frombuffer(mask.to_bytes(nbytes, 'little'), dtype=np.uint8)
+        #a digraph takes two characters
+        words = np.array(self.words, dtype='<U%d' % max(2 * self.l, 1))
+        return words, self.codes, packed, self.scores
+
+    def FromArrays(words, codes, packed, scores, alphabet):
+        """Rebuild an index from the output of Arrays, with the same alphabet."""
+        index = LengthIndex([], packed.shape[0], alphabet)
+        index.words = words.tolist()
+        index.n = len(index.words)
+        index.scores = np.asarray(scores, dtype=np.float64)
+        index.full = (1 << index.n) - 1
+        index.id = {w: j for j, w in enumerate(index.words)}
+        index.codes = np.asarray(codes, dtype=np.uint8)
+        for i in range(index.l):
+            for letter in range(packed.shape[1]):
+                mask = int.from_bytes(packed[i, letter].tobytes(), 'little')
+                if mask:
+                    index.masks[i][letter] = mask
+        return index
+
+    def Mask(self, words):
+        """Return the bitset of a collection of words."""
+        mask = 0
+        for w in words:
+            mask |= 1 << self.id[w]
+        return mask
+
+    def Words(self, mask):
+        """Return the list of words in a bitset."""
+        return [self.words[j] for j in ids(mask, self.n)]
+
+    def Letters(self, mask, i):
+        """Return the set of letter numbers at position i of the words in a bitset."""
+        return set(letter for letter, m in self.masks[i].items() if m & mask)
+
+    def LetterMask(self, i, letters):
+        """Return the bitset of words with any of the given letter numbers at position i."""
+        mask = 0
+        options = self.masks[i]
+        for letter in letters:
+            mask |= options.get(letter, 0)
+        return mask
+
+class VocabIndex:
+    def __init__(self, vocabdict=None, alphabet=None, scores=None):
+        """Index a vocabulary, given as a dict that maps lengths to sets of
+        words. Words are grouped again by their number of letters, since a word
+        with "ij" has fewer letters than characters. See LengthIndex for scores."""
+        self.alphabet = alphabet if alphabet is not None else Alphabet()
+        self.lengths = dict()
+        #functions that build the index of a length, see Defer
+        self.pending = dict()
+        if vocabdict:
+            bylength = dict()
+            for words in vocabdict.values():
+                for w in words:
+                    bylength.setdefault(len(tokenise(w)), set()).add(w)
+            for l, words in bylength.items():
+                self.lengths[l] = LengthIndex(words, l, self.alphabet, scores)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def Defer(self, l, build):
+        """Build the index of length l only when it is first used, by calling build."""
+        self.pending[l] = build
+
+    def Load(self):
+        """Build all deferred lengths now, for instance before forking workers
+        that should share them."""
+        for l in list(self.pending):
+            self.Length(l)
+
+    def Length(self, l):
+        """Return the index of words of length l. Lengths that are not in the
+        vocabulary get an empty index."""
+        if l not in self.lengths:
+            if l in self.pending:
+                self.lengths[l] = self.pending.pop(l)()
+            else:
+                self.lengths[l] = LengthIndex([], l, self.alphabet)
+        return self.lengths[l]